@@ -0,0 +1,455 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+from urllib.parse import parse_qsl
+
+import anyio
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from werkzeug.datastructures import MultiDict
+from werkzeug.formparser import parse_form_data
+
+import cache
+import imaging
+import instagram
+import metrics
+import pipeline
+import upstream
+from prompts import MODEL, MAX_TOKENS
+import schemas
+
+# ——— 비동기 서빙 경로 ———
+# app.py 와 같은 API 를 ASGI 로 제공한다. 워커 하나가 여러 요청을 동시에 들고 있을 수 있고,
+# /risk_assess 는 스크래핑과 이미지 디코딩을 겹쳐서 실행한다.
+# 엔드포인트 동작은 pipeline.py 에 있고, 여기서는 그 효과를 비동기로 실행하고 응답을 보낸다.
+# 실행: gunicorn -k uvicorn.workers.UvicornWorker aio:app
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+assert OPENAI_API_KEY, "OPENAI_API_KEY is required"
+
+# 요청 하나에 쓸 수 있는 전체 시간(초). 본문의 "deadline" 이나 X-Deadline 헤더로 줄일 수 있다
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 20))
+# 마감시간 중 스크래핑에 쓸 수 있는 비율 — 나머지는 LLM 호출 몫
+SCRAPE_BUDGET = float(os.getenv("SCRAPE_BUDGET", 0.3))
+
+# 재시도는 upstream 스케줄러가 마감시간 안에서 백오프하며 하므로 클라이언트 재시도는 끈다
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+llm = upstream.async_from_env(MODEL)
+result_cache = cache.from_env()
+profiles = instagram.async_from_env()
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, X-Deadline, Cache-Control"),
+]
+
+
+class Request:
+    def __init__(self, scope, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode(), keep_blank_values=True))
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1")
+                        for k, v in scope["headers"]}
+        self.body = body
+        self.started = time.monotonic()
+        self.deadline = self.started + REQUEST_DEADLINE
+
+    # JSON 해석과 base64 디코딩이 이벤트 루프를 막지 않도록 스레드에서 부른다
+    def upload(self):
+        content_type = self.headers.get("content-type", "")
+        mimetype = content_type.split(";")[0].strip().lower()
+        return pipeline.read_upload(mimetype, self.args, io.BytesIO(self.body),
+                                    len(self.body), self._multipart)
+
+    # multipart 는 werkzeug 파서에 WSGI environ 모양으로 넘긴다 (Flask 쪽과 같은 파서)
+    def _multipart(self):
+        _, form, files = parse_form_data({
+            "REQUEST_METHOD": self.method,
+            "CONTENT_TYPE": self.headers.get("content-type", ""),
+            "CONTENT_LENGTH": str(len(self.body)),
+            "wsgi.input": io.BytesIO(self.body),
+        })
+        return form, files
+
+    def set_deadline(self, fields: dict):
+        requested = fields.get("deadline")
+        if requested is None:
+            requested = self.headers.get("x-deadline")
+        if requested is None:
+            return
+        try:
+            requested = float(requested)
+        except (TypeError, ValueError):
+            raise pipeline.BadRequest("deadline must be a number of seconds")
+        if not requested > 0:
+            raise pipeline.BadRequest("deadline must be positive")
+        self.deadline = self.started + min(REQUEST_DEADLINE, requested)
+
+
+def remaining(deadline: float) -> float:
+    return max(0.0, deadline - time.monotonic())
+
+
+# ——— 파이프라인 효과 실행 (비동기) ———
+
+async def identify_image(effect: pipeline.Identify, req: Request) -> str:
+    with metrics.stage("image"):
+        return await anyio.to_thread.run_sync(imaging.image_id, effect.raw)
+
+
+async def fetch_user_interactions(username: str) -> dict:
+    with metrics.stage("instagram"):
+        return await profiles.get(username)
+
+
+# 스크래핑은 마감시간의 SCRAPE_BUDGET 안에서만 기다린다
+async def fetch_profiles(effect: pipeline.FetchProfiles, req: Request) -> list:
+    scrape_deadline = req.started + (req.deadline - req.started) * SCRAPE_BUDGET
+
+    async def fetch(username: str):
+        try:
+            return await asyncio.wait_for(fetch_user_interactions(username),
+                                          remaining(scrape_deadline))
+        except asyncio.TimeoutError:
+            # 지인 정보 없이라도 답을 준다. 취소된 건 이 대기뿐이고 스크래핑은 계속돼 캐시를 채운다
+            return None
+
+    return list(await asyncio.gather(*(fetch(u) for u in effect.usernames)))
+
+
+# 스크래핑을 띄워두고 기다리는 동안 이미지 해시를 끝낸다. 하나가 실패하면 나머지는 취소한다
+async def gather(effect: pipeline.Gather, req: Request) -> list:
+    tasks = [asyncio.ensure_future(execute(e, req)) for e in effect.effects]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+# 디스크 캐시가 켜져 있으면 sqlite 호출이 이벤트 루프를 막지 않도록 스레드로 넘긴다
+async def cache_get(effect: pipeline.CacheGet, req: Request):
+    if effect.bypass:
+        result_cache.record_bypass()
+        metrics.record_cache("bypass")
+        return None
+    with metrics.stage("cache"):
+        if result_cache.db_path:
+            hit = await anyio.to_thread.run_sync(result_cache.get, effect.key)
+        else:
+            hit = result_cache.get(effect.key)
+    metrics.record_cache("hit" if hit is not None else "miss")
+    return hit
+
+
+async def cache_set(effect: pipeline.CacheSet, req: Request):
+    if result_cache.db_path:
+        await anyio.to_thread.run_sync(result_cache.set, effect.key, effect.body)
+    else:
+        result_cache.set(effect.key, effect.body)
+
+
+async def check_llm(effect: pipeline.Check, req: Request):
+    llm.check()
+
+
+async def profiles_cached(effect: pipeline.ProfilesCached, req: Request) -> bool:
+    return all(profiles.cached(u) for u in effect.usernames)
+
+
+async def _complete(messages: list, schema, max_tokens: int, deadline: float):
+    async def create():
+        with metrics.stage("openai"):
+            return await client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=schemas.response_format(schema),
+                timeout=remaining(deadline),
+            )
+
+    response = await llm.call(create, upstream.estimate_tokens(messages, max_tokens), deadline)
+    metrics.record_usage(response.usage)
+    return schemas.validate(schema, response.choices[0].message.content)
+
+
+async def complete(effect: pipeline.Complete, req: Request):
+    try:
+        return await asyncio.wait_for(
+            _complete(effect.messages, effect.schema, effect.max_tokens, req.deadline),
+            remaining(req.deadline))
+    except asyncio.TimeoutError:
+        raise pipeline.DeadlineExceeded() from None
+
+
+EFFECTS = {
+    pipeline.Identify: identify_image,
+    pipeline.FetchProfiles: fetch_profiles,
+    pipeline.Gather: gather,
+    pipeline.CacheGet: cache_get,
+    pipeline.CacheSet: cache_set,
+    pipeline.Check: check_llm,
+    pipeline.ProfilesCached: profiles_cached,
+    pipeline.Complete: complete,
+}
+
+
+async def execute(effect, req: Request):
+    return await EFFECTS[type(effect)](effect, req)
+
+
+# 스트리밍 호출: 받은 조각을 SSE 이벤트로 바로 내보내고, 전체 텍스트를 돌려준다
+async def stream_tokens(effect: pipeline.StreamTokens, req: Request, emit) -> str:
+    parts = []
+    async with llm.admit(upstream.estimate_tokens(effect.messages, MAX_TOKENS),
+                         req.deadline) as ticket:
+        with metrics.stage("openai"):
+            stream = await client.chat.completions.create(
+                model=MODEL,
+                messages=effect.messages,
+                temperature=0.0,
+                max_tokens=MAX_TOKENS,
+                response_format=schemas.response_format(effect.schema),
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=remaining(req.deadline),
+            )
+            async for chunk in stream:
+                # 마지막 조각에는 choices 없이 usage 만 들어 있다
+                usage = getattr(chunk, "usage", None)
+                metrics.record_usage(usage)
+                ticket.settle(usage)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                for event in pipeline.delta_events(delta, effect.fields):
+                    await emit(event)
+    return "".join(parts)
+
+
+# 파이프라인을 끝까지 돌린다. Emit 은 emit 으로 내보내고(스트리밍 본문), 반환값은 파이프라인의 결과
+async def drive(steps, req: Request, emit=None):
+    value, error = None, None
+    while True:
+        try:
+            effect = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(effect, pipeline.Emit):
+                await emit(effect.text)
+            elif isinstance(effect, pipeline.StreamTokens):
+                value = await stream_tokens(effect, req, emit)
+            else:
+                value = await execute(effect, req)
+        except Exception as e:
+            error = e
+
+
+# ——— 응답 ———
+
+async def run_batch(batch: pipeline.BatchReply, req: Request, emit):
+    # 캐시 적중은 바로 내보낸다
+    lines, chunks = await drive(pipeline.batch_lookup(batch), req)
+    for line in lines:
+        await emit(line)
+
+    slots = asyncio.Semaphore(pipeline.BATCH_CONCURRENCY)
+
+    async def score(chunk: list) -> list:
+        async with slots:
+            return await drive(pipeline.score_chunk(batch, chunk), req)
+
+    tasks = {asyncio.ensure_future(score(chunk)): chunk for chunk in chunks}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    lines = task.result()
+                except Exception as e:
+                    lines = pipeline.chunk_error(tasks[task], e)
+                for line in lines:
+                    await emit(line)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def respond(send, req: Request, reply) -> int:
+    if isinstance(reply, pipeline.Reply):
+        await send_response(send, reply.status,
+                            json.dumps(reply.body, ensure_ascii=False).encode(),
+                            b"application/json", reply.headers)
+        return reply.status
+
+    async def emit(text: str):
+        await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+    if isinstance(reply, pipeline.StreamReply):
+        await start_stream(send, b"text/event-stream",
+                           {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        await drive(reply.events, req, emit)
+    else:
+        await start_stream(send, b"application/x-ndjson")
+        await run_batch(reply, req, emit)
+    await send({"type": "http.response.body", "body": b""})
+    return 200
+
+
+async def ping(req: Request):
+    return pipeline.Reply(200, {"pong": True})
+
+
+async def cache_stats(req: Request):
+    return pipeline.Reply(200, result_cache.stats())
+
+
+# 요청 본문을 받는 엔드포인트 — pipeline 의 핸들러를 그대로 쓴다
+PIPELINES = {
+    ("POST", "/analyze"): pipeline.analyze,
+    ("POST", "/risk_assess"): pipeline.risk_assess,
+    ("POST", "/analyze/batch"): pipeline.analyze_batch,
+    ("POST", "/risk_assess/batch"): pipeline.risk_assess_batch,
+}
+ROUTES = {
+    ("GET", "/ping"): ping,
+    ("GET", "/cache/stats"): cache_stats,
+}
+KNOWN_PATHS = {path for _, path in [*ROUTES, *PIPELINES]} | {"/", "/metrics"}
+
+
+async def handle(req: Request, handler):
+    try:
+        with metrics.stage("parse"):
+            fields, raw = await anyio.to_thread.run_sync(req.upload)
+        req.set_deadline(fields)
+    except (imaging.ImageError, pipeline.BadRequest) as e:
+        return pipeline.client_error(e)
+    payload = pipeline.Payload(fields, raw, req.args, req.headers)
+    return await drive(pipeline.guarded(req.path, handler(payload)), req)
+
+
+def content_length(scope) -> int:
+    value = dict(scope["headers"]).get(b"content-length", b"0")
+    try:
+        length = int(value)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise pipeline.BadRequest("invalid content-length")
+    return length
+
+
+# 조각씩 받다가 한도를 넘으면 바로 멈춘다
+async def read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        imaging.check_body(size)
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _headers(content_type: bytes, extra=None) -> list:
+    headers = [(b"content-type", content_type)] + CORS_HEADERS
+    for k, v in (extra or {}).items():
+        headers.append((k.lower().encode("latin-1"), v.encode("latin-1")))
+    return headers
+
+
+async def send_response(send, status: int, body: bytes, content_type: bytes, extra=None):
+    headers = _headers(content_type, extra) + [(b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def start_stream(send, content_type: bytes, extra=None):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": _headers(content_type, extra)})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await profiles.aclose()
+            await client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    # 요청마다 태스크 컨텍스트가 따로라서 타이머가 섞이지 않는다
+    timer = metrics.start_request(scope["path"] if scope["path"] in KNOWN_PATHS else "unmatched")
+    # dispatch 가 예외로 끝나면(클라이언트 연결 끊김 등) 500 으로 기록한다
+    status = 500
+    try:
+        status = await dispatch(scope, receive, send)
+    finally:
+        timer.finish(str(status))
+
+
+async def dispatch(scope, receive, send) -> int:
+    try:
+        with metrics.stage("parse"):
+            imaging.check_body(content_length(scope))
+            body = await read_body(receive)
+    except (imaging.ImageError, pipeline.BadRequest) as e:
+        await send_response(send, e.status, json.dumps({"error": str(e)}).encode(),
+                            b"application/json")
+        return e.status
+    req = Request(scope, body)
+    if req.method == "OPTIONS":
+        await send_response(send, 200, b"", b"text/plain")
+        return 200
+    if req.method == "GET" and req.path == "/":
+        await send_response(send, 200, "SafePost API is running!".encode(),
+                            b"text/html; charset=utf-8")
+        return 200
+    if req.method == "GET" and req.path == "/metrics":
+        extra = pipeline.gauges(result_cache, profiles, llm)
+        await send_response(send, 200, metrics.render(extra).encode(),
+                            b"text/plain; version=0.0.4")
+        return 200
+
+    key = (req.method, req.path)
+    if key in PIPELINES:
+        reply = await handle(req, PIPELINES[key])
+    elif key in ROUTES:
+        reply = await ROUTES[key](req)
+    else:
+        reply = pipeline.Reply(404, {"error": "not found"})
+    return await respond(send, req, reply)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
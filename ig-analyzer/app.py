@@ -1,16 +1,25 @@
 import logging
-import traceback
 import os
-import base64
-import requests
-from flask import Flask, request, jsonify
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 from openai import OpenAI
 from flask_cors import CORS
 
+import cache
+import imaging
+import instagram
+import metrics
+import pipeline
+import upstream
+from prompts import MODEL, MAX_TOKENS
+import schemas
+
 # ——— 로깅 설정 ———
+# 기본은 INFO. 모델 응답 전문 같은 DEBUG 로그는 LOG_SAMPLE_RATE 비율로만 남긴다
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
@@ -19,41 +28,208 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 assert OPENAI_API_KEY, "OPENAI_API_KEY is required"
 
-# OpenAI 클라이언트 초기화
-client = OpenAI(api_key=OPENAI_API_KEY)
+# OpenAI 클라이언트 초기화. 재시도는 upstream 스케줄러가 백오프와 예산을 보면서 하므로 끈다
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, timeout=OPENAI_TIMEOUT)
+# OpenAI 호출 입장 관리: 동시 호출 수/대기열, RPM·TPM 예산, 재시도, 서킷 브레이커
+llm = upstream.from_env(MODEL)
+
+# 분석 결과 캐시 (temperature=0 이라 같은 입력이면 같은 결과)
+result_cache = cache.from_env()
 
 # Flask 앱 초기화
 app = Flask(__name__)
+# 한도를 넘는 본문은 werkzeug 가 읽기 전에 413 으로 끊는다
+app.config["MAX_CONTENT_LENGTH"] = imaging.MAX_BODY_BYTES
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
-# 스크래핑을 통한 사용자 활동 수집 함수
+# 스크래핑을 통한 사용자 활동 수집 (커넥션 풀 + 사용자별 캐시)
+profiles = instagram.from_env()
 
-def fetch_user_interactions(username: str, limit: int = 5) -> dict:
-    interactions = {"recent_posts": [], "avg_likes": 0, "recent_comment_texts": []}
-    try:
-        UA = (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
+def fetch_user_interactions(username: str) -> dict:
+    with metrics.stage("instagram"):
+        return profiles.get(username)
+
+
+# ——— 요청 계측 ———
+@app.before_request
+def start_timer():
+    metrics.start_request(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def finish_timer(response):
+    timer = metrics.current()
+    if timer is not None:
+        # 스트리밍 응답은 본문을 다 보낸 뒤에 닫히므로 그때 전체 시간을 잰다
+        response.call_on_close(lambda: timer.finish(str(response.status_code)))
+    return response
+
+# 스레드 풀에서 돌려도 같은 요청의 타이머에 단계 시간이 쌓이도록 컨텍스트를 복사해 넘긴다
+def submit(pool, fn, *args):
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+# ——— 파이프라인 효과 실행 (동기) ———
+# 요청 처리 순서는 pipeline.py 에 있고, 여기서는 핸들러가 yield 한 효과만 실행한다
+
+def identify_image(effect: pipeline.Identify) -> str:
+    with metrics.stage("image"):
+        return imaging.image_id(effect.raw)
+
+def fetch_profiles(effect: pipeline.FetchProfiles) -> list:
+    if len(effect.usernames) == 1:
+        return [fetch_user_interactions(effect.usernames[0])]
+    # 지인 여러 명은 동시에 가져온다
+    with ThreadPoolExecutor(max_workers=pipeline.BATCH_CONCURRENCY) as pool:
+        futures = [submit(pool, fetch_user_interactions, u) for u in effect.usernames]
+        return [f.result() for f in futures]
+
+# 동기 서버에서는 순서대로 실행한다
+def gather(effect: pipeline.Gather) -> list:
+    return [execute(e) for e in effect.effects]
+
+def cache_lookup(effect: pipeline.CacheGet):
+    if effect.bypass:
+        result_cache.record_bypass()
+        metrics.record_cache("bypass")
+        return None
+    with metrics.stage("cache"):
+        hit = result_cache.get(effect.key)
+    metrics.record_cache("hit" if hit is not None else "miss")
+    return hit
+
+def cache_store(effect: pipeline.CacheSet):
+    result_cache.set(effect.key, effect.body)
+
+def check_llm(effect: pipeline.Check):
+    llm.check()
+
+def profiles_cached(effect: pipeline.ProfilesCached) -> bool:
+    return all(profiles.cached(u) for u in effect.usernames)
+
+def complete(effect: pipeline.Complete):
+    messages, schema, max_tokens = effect.messages, effect.schema, effect.max_tokens
+
+    def create():
+        with metrics.stage("openai"):
+            return client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=schemas.response_format(schema)
+            )
+
+    response = llm.call(create, upstream.estimate_tokens(messages, max_tokens))
+    metrics.record_usage(response.usage)
+    return schemas.validate(schema, response.choices[0].message.content)
+
+EFFECTS = {
+    pipeline.Identify: identify_image,
+    pipeline.FetchProfiles: fetch_profiles,
+    pipeline.Gather: gather,
+    pipeline.CacheGet: cache_lookup,
+    pipeline.CacheSet: cache_store,
+    pipeline.Check: check_llm,
+    pipeline.ProfilesCached: profiles_cached,
+    pipeline.Complete: complete,
+}
+
+def execute(effect):
+    return EFFECTS[type(effect)](effect)
+
+# 스트리밍 호출: 받은 조각을 SSE 이벤트로 바로 내보내고, 전체 텍스트를 돌려준다
+def stream_tokens(effect: pipeline.StreamTokens):
+    parts = []
+    with llm.admit(upstream.estimate_tokens(effect.messages, MAX_TOKENS)) as ticket, \
+            metrics.stage("openai"):
+        stream = client.chat.completions.create(
+            model=MODEL,
+            messages=effect.messages,
+            temperature=0.0,
+            max_tokens=MAX_TOKENS,
+            response_format=schemas.response_format(effect.schema),
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        url = f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}"
-        headers = {"User-Agent": UA}
-        resp = requests.get(url, headers=headers)
-        resp.raise_for_status()
-        user = resp.json()["data"]["user"]
-
-        edges = user["edge_owner_to_timeline_media"]["edges"][:limit]
-        likes = []
-        for edge in edges:
-            node = edge["node"]
-            cap_edges = node.get("edge_media_to_caption", {}).get("edges", [])
-            text = cap_edges[0]["node"]["text"][:100] if cap_edges else ""
-            interactions["recent_posts"].append(text)
-            likes.append(node.get("edge_liked_by", {}).get("count", 0))
-        if likes:
-            interactions["avg_likes"] = sum(likes) // len(likes)
-    except Exception:
-        logging.error("Instagram 스크래핑 오류:\n%s", traceback.format_exc())
-    return interactions
+        for chunk in stream:
+            # 마지막 조각에는 choices 없이 usage 만 들어 있다
+            usage = getattr(chunk, "usage", None)
+            metrics.record_usage(usage)
+            ticket.settle(usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            yield from pipeline.delta_events(delta, effect.fields)
+    return "".join(parts)
+
+# 파이프라인을 끝까지 돌린다. Emit 은 그대로 내보내고(스트리밍 본문), 반환값은 파이프라인의 결과
+def drive(steps):
+    value, error = None, None
+    while True:
+        try:
+            effect = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(effect, pipeline.Emit):
+                yield effect.text
+            elif isinstance(effect, pipeline.StreamTokens):
+                value = yield from stream_tokens(effect)
+            else:
+                value = execute(effect)
+        except Exception as e:
+            error = e
+
+# 본문을 내보내지 않는 파이프라인용
+def run(steps):
+    driver = drive(steps)
+    try:
+        text = next(driver)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError(f"unexpected output: {text!r}")
+
+# ——— 응답 ———
+
+def run_batch(batch: pipeline.BatchReply):
+    # 캐시 적중은 바로 내보낸다
+    lines, chunks = run(pipeline.batch_lookup(batch))
+    yield from lines
+    with ThreadPoolExecutor(max_workers=pipeline.BATCH_CONCURRENCY) as pool:
+        futures = {submit(pool, run, pipeline.score_chunk(batch, chunk)): chunk
+                   for chunk in chunks}
+        for fut in as_completed(futures):
+            try:
+                lines = fut.result()
+            except Exception as e:
+                lines = pipeline.chunk_error(futures[fut], e)
+            yield from lines
+
+def respond(reply):
+    if isinstance(reply, pipeline.StreamReply):
+        return Response(drive(reply.events), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if isinstance(reply, pipeline.BatchReply):
+        return Response(run_batch(reply), mimetype="application/x-ndjson")
+    resp = jsonify(reply.body)
+    resp.status_code = reply.status
+    resp.headers.update(reply.headers)
+    return resp
+
+def read_upload():
+    with metrics.stage("parse"):
+        return pipeline.read_upload(request.mimetype, request.args, request.stream,
+                                    request.content_length, lambda: (request.form, request.files))
+
+def handle(name: str, handler):
+    try:
+        fields, raw = read_upload()
+    except (imaging.ImageError, pipeline.BadRequest) as e:
+        return respond(pipeline.client_error(e))
+    payload = pipeline.Payload(fields, raw, request.args, request.headers)
+    return respond(run(pipeline.guarded(name, handler(payload))))
 
 @app.route('/ping', methods=['GET'])
 def ping():
@@ -63,94 +239,40 @@ def ping():
 def home():
     return "SafePost API is running!"
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    extra = pipeline.gauges(result_cache, profiles, llm)
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    try:
-        data = request.get_json()
-        caption = data.get("caption", "")
-        image_b64 = data.get("image")
-        if not image_b64:
-            return jsonify({"error": "image missing"}), 400
-
-        prompt = f"""
-너는 인스타그램 감성 분석 도우미야.
-아래 게시물(이미지+캡션)을 분석해서:
-1. 사람들이 싫어하지 않을 확률 (0~100 숫자만)
-2. 위험도에 대한 짧고 구체적인 경고 메시지
-3. 개선을 위한 짧고 구체적인 추천 메시지
-출력 형식:
-싫어하지않을확률: 85%
-경고: ...
-추천: ...
-캡션: {caption}
-"""
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "당신은 인스타그램 감성 분석 도우미입니다. 응답은 오직 위 형식의 세 줄 텍스트만으로 구성하세요."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0,
-            max_tokens=300
-        )
-        raw_text = response.choices[0].message.content.strip()
-        logging.debug("analyze 응답: %s", raw_text)
-        return jsonify({"result": raw_text})
-    except Exception as e:
-        tb = traceback.format_exc()
-        logging.error("analyze 오류:\n%s", tb)
-        return jsonify({"error": str(e), "traceback": tb}), 500
+    return handle("analyze", pipeline.analyze)
 
 @app.route('/risk_assess', methods=['OPTIONS'])
 def risk_assess_preflight():
     return ('', 200, {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
+        'Access-Control-Allow-Headers': 'Content-Type, X-Deadline, Cache-Control'
     })
 
 @app.route('/risk_assess', methods=['POST'])
 def risk_assess():
-    try:
-        payload = request.get_json()
-        caption = payload.get("caption", "")
-        image_b64 = payload.get("image")
-        target_id = payload.get("target_user_id")
-        if not image_b64 or not target_id:
-            return jsonify({"error": "image or target_user_id missing"}), 400
-
-        interactions = fetch_user_interactions(target_id)
-        prompt = f"""
-너는 인스타 지인 반응 리스크 평가 전문가야.
-지인({target_id})의 최근 활동:
-- 최근 게시물 요약: {interactions['recent_posts']}
-- 평균 좋아요 수: {interactions['avg_likes']}
-아래 게시물(이미지+캡션)에 대해
-1) 싫어하지않을확률(0~100)%
-2) 민감포인트
-3) 공개범위추천
-출력 형식 (중괄호와 따옴표 없이, 한 줄씩):
-싫어하지않을확률: 10%
-민감포인트: 짧은 캡션
-공개범위추천: 친구공개
-캡션: {caption}
-"""
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "영어 사용 금지. 응답은 오직 지정된 텍스트 형식의 네 줄만으로 구성하세요."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0,
-            max_tokens=300
-        )
-        result = response.choices[0].message.content.strip()
-        logging.debug("risk_assess 응답: %s", result)
-        return jsonify({"risk_assessment": result})
-    except Exception as e:
-        tb = traceback.format_exc()
-        logging.error("risk_assess 오류:\n%s", tb)
-        return jsonify({"error": str(e), "traceback": tb}), 500
+    return handle("risk_assess", pipeline.risk_assess)
+
+# ——— 배치 분석 ———
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    return handle("analyze_batch", pipeline.analyze_batch)
+
+@app.route('/risk_assess/batch', methods=['POST'])
+def risk_assess_batch():
+    return handle("risk_assess_batch", pipeline.risk_assess_batch)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,209 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ——— 벤치마크용 가짜 업스트림 ———
+# OpenAI chat completions 와 Instagram web_profile_info 를 흉내 내는 로컬 서버.
+# 지연/지터/오류율/스트리밍을 조절할 수 있고, 같은 프로세스 안에서 띄우거나 단독으로 실행할 수 있다.
+#   python -m bench.fakes --openai-port 9001 --instagram-port 9002 --latency 0.8
+
+
+class Upstream:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 token_delay: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.missing = set()  # 404 로 답할 인스타그램 username
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self) -> bool:
+        return random.random() < self.error_rate
+
+
+# JSON schema 를 보고 조건에 맞는 값을 만든다. 배열은 프롬프트의 캡션 개수만큼 채운다
+def sample(schema: dict, defs: dict, items: int):
+    if "$ref" in schema:
+        return sample(defs[schema["$ref"].split("/")[-1]], defs, items)
+    if "enum" in schema:
+        return random.choice(schema["enum"])
+    kind = schema.get("type")
+    if kind == "object":
+        return {k: sample(v, defs, items) for k, v in schema["properties"].items()}
+    if kind == "array":
+        values = [sample(schema["items"], defs, items) for _ in range(items)]
+        # 배치 응답 항목에는 캡션 번호(1부터)를 채운다
+        for i, value in enumerate(values, 1):
+            if isinstance(value, dict) and "index" in value:
+                value["index"] = i
+        return values
+    if kind == "integer":
+        return random.randint(0, 100)
+    if kind == "number":
+        return round(random.random(), 3)
+    if kind == "boolean":
+        return random.random() < 0.5
+    return "벤치마크용 응답 문장입니다"
+
+
+def fake_completion(body: dict) -> str:
+    fmt = body.get("response_format") or {}
+    if fmt.get("type") != "json_schema":
+        return "싫어하지않을확률: 80%\n경고: 없음\n추천: 없음"
+    schema = fmt["json_schema"]["schema"]
+    prompt = body["messages"][-1]["content"]
+    items = max(1, prompt.count("] 캡션:"))
+    return json.dumps(sample(schema, schema.get("$defs", {}), items), ensure_ascii=False)
+
+
+def usage(body: dict, text: str) -> dict:
+    prompt = sum(len(str(m["content"])) for m in body["messages"]) // 2
+    completion = len(text) // 2
+    return {"prompt_tokens": prompt, "completion_tokens": completion,
+            "total_tokens": prompt + completion}
+
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    upstream = Upstream()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, obj: dict):
+        data = json.dumps(obj, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.upstream.wait()
+        if self.upstream.should_fail():
+            status = random.choice((429, 500, 503))
+            return self._json(status, {"error": {"message": "fake upstream error",
+                                                 "type": "server_error", "code": None}})
+
+        text = fake_completion(body)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o")}
+        if not body.get("stream"):
+            return self._json(200, dict(base, object="chat.completion", choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }], usage=usage(body, text)))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(text), 4):
+            self._chunk(dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "finish_reason": None, "delta": {"content": text[i:i + 4]},
+            }]))
+            time.sleep(self.upstream.token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._chunk(dict(base, object="chat.completion.chunk", choices=[],
+                             usage=usage(body, text)))
+        self._write(b"data: [DONE]\n\n")
+        self._write(b"")
+
+    def _chunk(self, obj: dict):
+        self._write(f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode())
+
+    def _write(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class InstagramHandler(BaseHTTPRequestHandler):
+    upstream = Upstream()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.upstream.wait()
+        if self.upstream.should_fail():
+            self.send_response(429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        username = parse_qs(urlparse(self.path).query).get("username", ["anon"])[0]
+        if username in self.upstream.missing:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        edges = [{"node": {
+            "edge_media_to_caption": {"edges": [{"node": {"text": f"{username} 의 게시물 {i}"}}]},
+            "edge_liked_by": {"count": random.randint(0, 500)},
+        }} for i in range(12)]
+        data = json.dumps({"data": {"user": {"edge_owner_to_timeline_media": {"edges": edges}}}},
+                          ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# 핸들러 클래스를 서버마다 새로 만들어서 설정(Upstream)이 서로 섞이지 않게 한다
+def serve(handler, upstream: Upstream, port: int = 0, host: str = "127.0.0.1"):
+    cls = type(handler.__name__, (handler,), {"upstream": upstream})
+    server = ThreadingHTTPServer((host, port), cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def start_openai(port: int = 0, **kwargs):
+    server, url = serve(OpenAIHandler, Upstream(**kwargs), port)
+    return server, url + "/v1"
+
+
+def start_instagram(port: int = 0, **kwargs):
+    return serve(InstagramHandler, Upstream(**kwargs), port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 OpenAI / Instagram 서버")
+    parser.add_argument("--openai-port", type=int, default=9001)
+    parser.add_argument("--instagram-port", type=int, default=9002)
+    parser.add_argument("--latency", type=float, default=0.8, help="OpenAI 응답 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="스트리밍 조각 사이 지연")
+    parser.add_argument("--ig-latency", type=float, default=0.3)
+    parser.add_argument("--ig-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    _, openai_url = start_openai(args.openai_port, latency=args.latency, jitter=args.jitter,
+                                 error_rate=args.error_rate, token_delay=args.token_delay)
+    _, ig_url = start_instagram(args.instagram_port, latency=args.ig_latency,
+                                jitter=args.ig_latency / 4, error_rate=args.ig_error_rate)
+    print(f"OPENAI_BASE_URL={openai_url}")
+    print(f"INSTAGRAM_BASE_URL={ig_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import asyncio
+import base64
+import io
+import itertools
+import os
+import random
+import time
+
+import httpx
+
+# ——— 부하 생성기 ———
+# 엔드포인트별로 동시 요청 수를 고정해 두고 정해진 시간 동안 계속 보낸다.
+# 처리량, 지연시간 분위수, 상태 코드 분포를 모으고, 서버 프로세스의 최대 RSS 도 같이 잰다
+
+
+def sample_image() -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        # Pillow 가 없으면 1x1 PNG 로 대신한다
+        return base64.b64decode(
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC")
+    # 실제 업로드와 비슷하게 축소가 일어나는 크기로 만든다
+    img = Image.effect_noise((1600, 1200), 64).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+# 요청 본문 만들기. hit_ratio 만큼은 같은 캡션을 다시 보내서 결과 캐시에 맞도록 한다
+class Payloads:
+    def __init__(self, hit_ratio: float = 0.0, users: int = 20):
+        self.image = base64.b64encode(sample_image()).decode()
+        self.hit_ratio = hit_ratio
+        self.users = [f"bench_user_{i}" for i in range(users)]
+        self._seq = itertools.count()
+
+    def caption(self) -> str:
+        if random.random() < self.hit_ratio:
+            return "벤치마크 고정 캡션"
+        return f"벤치마크 캡션 {next(self._seq)}"
+
+    def analyze(self) -> dict:
+        return {"image": self.image, "caption": self.caption()}
+
+    def risk_assess(self) -> dict:
+        return dict(self.analyze(), target_user_id=random.choice(self.users))
+
+
+ENDPOINTS = {
+    "ping": ("GET", "/ping", None),
+    "analyze": ("POST", "/analyze", Payloads.analyze),
+    "risk_assess": ("POST", "/risk_assess", Payloads.risk_assess),
+}
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+# ——— 프로세스 메모리 ———
+# /proc/<pid>/status 의 VmHWM(최대 RSS) 를 읽는다. 리눅스 전용이고 다른 OS 에서는 빈 값
+
+def _parents() -> dict:
+    parents = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # 프로세스 이름에 공백이 있을 수 있어서 마지막 ')' 뒤부터 자른다
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return parents
+
+
+def process_tree(pid: int) -> list:
+    parents = _parents()
+    pids = [pid]
+    for p in pids:
+        pids += sorted(c for c, parent in parents.items() if parent == p)
+    return pids
+
+
+def peak_rss_kb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    def __init__(self, pid: int, workers_only: bool):
+        self.pid = pid
+        self.workers_only = workers_only
+        self.peaks = {}
+
+    def sample(self):
+        pids = process_tree(self.pid)
+        if self.workers_only and len(pids) > 1:
+            pids = pids[1:]
+        for pid in pids:
+            kb = peak_rss_kb(pid)
+            if kb is not None:
+                self.peaks[pid] = max(self.peaks.get(pid, 0), kb)
+
+    async def run(self, stop: asyncio.Event, interval: float = 0.5):
+        while not stop.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        self.sample()
+
+
+# ——— 실행 ———
+
+async def _worker(client, method, path, build, payloads, until, latencies, statuses):
+    while time.monotonic() < until:
+        body = build(payloads) if build else None
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, path, json=body)
+            await resp.aread()
+            status = str(resp.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, duration: float,
+                    payloads: Payloads, server_pid: int = None, workers_only: bool = True,
+                    timeout: float = 60) -> dict:
+    method, path, build = ENDPOINTS[endpoint]
+    latencies, statuses = [], {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    sampler = RssSampler(server_pid, workers_only) if server_pid else None
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        rss_task = asyncio.create_task(sampler.run(stop)) if sampler else None
+        started = time.monotonic()
+        until = started + duration
+        await asyncio.gather(*(
+            _worker(client, method, path, build, payloads, until, latencies, statuses)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.monotonic() - started
+        stop.set()
+        if rss_task:
+            await rss_task
+
+    ok = sum(n for s, n in statuses.items() if s.startswith("2"))
+    peaks = sampler.peaks if sampler else {}
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "statuses": statuses,
+        "rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "workers": len(peaks),
+        "peak_rss_mb": round(max(peaks.values()) / 1024, 1) if peaks else None,
+    }
+
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="이미 떠 있는 서버에 부하를 건다")
+    parser.add_argument("--url", default=os.getenv("BENCH_URL", "http://127.0.0.1:5000"))
+    parser.add_argument("--endpoints", default="ping,analyze,risk_assess")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--hit-ratio", type=float, default=0.0)
+    parser.add_argument("--pid", type=int, help="RSS 를 잴 서버(gunicorn 마스터) PID")
+    args = parser.parse_args()
+
+    payloads = Payloads(args.hit_ratio)
+    for endpoint in args.endpoints.split(","):
+        for level in map(int, args.concurrency.split(",")):
+            row = asyncio.run(run_level(args.url, endpoint, level, args.duration,
+                                        payloads, args.pid))
+            print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench import fakes
+from bench.loadgen import Payloads, run_level
+
+# ——— 벤치마크 실행기 ———
+# 가짜 OpenAI/Instagram 을 띄우고, 서버 구성(Flask 개발 서버, gunicorn sync/gthread, uvicorn)을
+# 하나씩 실행해서 같은 부하를 건 뒤 결과를 표로 찍는다. ig-analyzer 디렉터리에서 실행한다.
+#   python -m bench.run --configs gunicorn-sync,uvicorn --concurrency 1,8,32 --duration 10
+# --save 로 결과를 남겨두고 --baseline 으로 비교하면 배포 전에 성능 저하를 잡을 수 있다.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def gunicorn(*args) -> list:
+    return [sys.executable, "-m", "gunicorn", "--log-level", "warning", *args]
+
+
+# 구성 이름 -> (명령, 워커 프로세스만 따로 재는지)
+def server_command(name: str, port: int, workers: int, threads: int):
+    bind = f"127.0.0.1:{port}"
+    if name == "flask":
+        return [sys.executable, "app.py"], False
+    if name == "gunicorn-sync":
+        return gunicorn("-w", str(workers), "-b", bind, "app:app"), True
+    if name == "gunicorn-gthread":
+        return gunicorn("-w", str(workers), "-k", "gthread", "--threads", str(threads),
+                        "-b", bind, "app:app"), True
+    if name == "uvicorn":
+        return gunicorn("-w", str(workers), "-k", "uvicorn.workers.UvicornWorker",
+                        "-b", bind, "aio:app"), True
+    raise ValueError(f"unknown config: {name}")
+
+
+CONFIGS = ("flask", "gunicorn-sync", "gunicorn-gthread", "uvicorn")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/ping", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def bench_config(name: str, args, env: dict) -> list:
+    port = free_port()
+    cmd, workers_only = server_command(name, port, args.workers, args.threads)
+    env = dict(env, PORT=str(port))
+    url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    rows = []
+    try:
+        wait_ready(url, proc)
+        payloads = Payloads(args.hit_ratio, args.users)
+        for endpoint in args.endpoints.split(","):
+            for level in map(int, args.concurrency.split(",")):
+                row = asyncio.run(run_level(url, endpoint, level, args.duration, payloads,
+                                            proc.pid, workers_only))
+                row["config"] = name
+                rows.append(row)
+                print(format_row(row), flush=True)
+    finally:
+        stop(proc)
+    return rows
+
+
+HEADER = (f"{'config':<18}{'endpoint':<13}{'conc':>5}{'reqs':>7}{'err':>6}{'rps':>9}"
+          f"{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'wrk':>5}{'rssMB':>8}")
+
+
+def format_row(row: dict) -> str:
+    rss = row["peak_rss_mb"] if row["peak_rss_mb"] is not None else "-"
+    return (f"{row['config']:<18}{row['endpoint']:<13}{row['concurrency']:>5}"
+            f"{row['requests']:>7}{row['errors']:>6}{row['rps']:>9}"
+            f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+            f"{row['workers']:>5}{rss:>8}")
+
+
+# 같은 (구성, 엔드포인트, 동시성) 끼리 비교해서 처리량이 줄거나 p95 가 늘어난 것을 골라낸다
+def regressions(rows: list, baseline: list, tolerance: float) -> list:
+    before = {(r["config"], r["endpoint"], r["concurrency"]): r for r in baseline}
+    found = []
+    for row in rows:
+        old = before.get((row["config"], row["endpoint"], row["concurrency"]))
+        if old is None:
+            continue
+        if old["rps"] and row["rps"] < old["rps"] * (1 - tolerance):
+            found.append(f"{format_row(row)}  rps {old['rps']} -> {row['rps']}")
+        if old["p95_ms"] and row["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            found.append(f"{format_row(row)}  p95 {old['p95_ms']} -> {row['p95_ms']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ig-analyzer 부하 테스트")
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--endpoints", default="ping,analyze,risk_assess")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10, help="단계별 실행 시간(초)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--hit-ratio", type=float, default=0.0, help="결과 캐시에 맞을 요청 비율")
+    parser.add_argument("--users", type=int, default=20, help="risk_assess 대상 지인 수")
+    parser.add_argument("--latency", type=float, default=0.8, help="가짜 OpenAI 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ig-latency", type=float, default=0.3)
+    parser.add_argument("--ig-error-rate", type=float, default=0.0)
+    parser.add_argument("--save", help="결과를 JSON 으로 저장할 경로")
+    parser.add_argument("--baseline", help="비교할 이전 결과 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="허용 오차 비율")
+    args = parser.parse_args()
+
+    _, openai_url = fakes.start_openai(latency=args.latency, jitter=args.jitter,
+                                       error_rate=args.error_rate)
+    _, ig_url = fakes.start_instagram(latency=args.ig_latency, jitter=args.ig_latency / 4,
+                                      error_rate=args.ig_error_rate)
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=openai_url,
+        INSTAGRAM_BASE_URL=ig_url,
+        RESULT_CACHE_DB="",
+        LOG_LEVEL="WARNING",
+    )
+
+    print(HEADER, flush=True)
+    rows = []
+    for name in args.configs.split(","):
+        rows += bench_config(name, args, env)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(rows, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSION", line)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
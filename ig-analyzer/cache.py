@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ——— 분석 결과 캐시 ———
+# 1단계: 워커 메모리 안의 LRU (TTL 포함)
+# 2단계: 선택적 SQLite 파일 — gunicorn 워커가 재시작돼도 유지된다
+
+# 디스크 캐시에 이만큼 쓸 때마다 만료된 행을 한 번 정리한다
+PRUNE_EVERY = 100
+
+
+def make_key(*parts) -> str:
+    # 각 조각 앞에 길이를 붙여서 ("ab", "c") 와 ("a", "bc") 가 같은 키가 되지 않게 한다
+    h = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray)):
+            part = json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600,
+                 db_path: str = None, disk_ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.disk_ttl = disk_ttl
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypass": 0, "evictions": 0}
+        self._writes = 0
+        if db_path:
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    # sqlite3 연결은 스레드 간 공유가 안 되므로 스레드마다 하나씩 연다
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # 정리할 차례인지: 쓰기 횟수로 세므로 트래픽이 적어도 많아도 PRUNE_EVERY 번에 한 번이다
+    def _prune_due(self) -> bool:
+        with self._lock:
+            self._writes += 1
+            return self._writes % PRUNE_EVERY == 0
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _mem_put(self, key: str, value, expires: float):
+        with self._lock:
+            self._mem[key] = (expires, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._mem.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._mem[key]
+
+        if self.db_path:
+            try:
+                row = self._db().execute(
+                    "SELECT value, expires FROM results WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                logging.warning("캐시 DB 조회 실패", exc_info=True)
+                row = None
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                # 디스크에서 찾은 값은 메모리 TTL 만큼만 다시 올려둔다
+                self._mem_put(key, value, min(row[1], now + self.ttl))
+                self._count("disk_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value):
+        now = time.time()
+        self._mem_put(key, value, now + self.ttl)
+        if self.db_path:
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now + self.disk_ttl),
+                )
+                if self._prune_due():
+                    db.execute("DELETE FROM results WHERE expires <= ?", (now,))
+            except sqlite3.Error:
+                logging.warning("캐시 DB 저장 실패", exc_info=True)
+
+    def record_bypass(self):
+        self._count("bypass")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._mem)
+        stats["max_entries"] = self.max_entries
+        stats["disk"] = bool(self.db_path)
+        return stats
+
+
+def from_env() -> ResultCache:
+    return ResultCache(
+        max_entries=int(os.getenv("RESULT_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+        db_path=os.getenv("RESULT_CACHE_DB") or None,
+        disk_ttl=float(os.getenv("RESULT_CACHE_DISK_TTL", 86400)),
+    )
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from bench import fakes
+from bench.loadgen import sample_image
+
+# app.py / aio.py 는 import 할 때 환경변수로 클라이언트를 만든다.
+# 테스트 모듈이 import 되기 전에 가짜 OpenAI / 인스타그램(bench.fakes)을 띄우고 그쪽을 가리키게 한다
+_openai, _openai_url = fakes.start_openai()
+_instagram, _instagram_url = fakes.start_instagram()
+os.environ.update(
+    OPENAI_API_KEY="test-key",
+    OPENAI_BASE_URL=_openai_url,
+    INSTAGRAM_BASE_URL=_instagram_url,
+    RESULT_CACHE_DB="",
+    OPENAI_BACKOFF_BASE="0.01",
+    OPENAI_BACKOFF_MAX="0.01",
+    LOG_LEVEL="WARNING",
+)
+
+
+def _reset(upstream: fakes.Upstream):
+    upstream.latency = upstream.jitter = upstream.error_rate = upstream.token_delay = 0.0
+    upstream.missing.clear()
+
+
+@pytest.fixture
+def openai_stub():
+    upstream = _openai.RequestHandlerClass.upstream
+    yield upstream
+    _reset(upstream)
+
+
+@pytest.fixture
+def instagram_stub():
+    upstream = _instagram.RequestHandlerClass.upstream
+    yield upstream
+    _reset(upstream)
+
+
+@pytest.fixture(scope="session")
+def image() -> bytes:
+    return sample_image()
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 가 없으면 디코딩 없이 원본 바이트 해시를 쓴다
+    Image = None
+
+# ——— 업로드 이미지 처리 ———
+# 크기 제한(본문 전체를 버퍼링하기 전에) → 아주 작게 축소 디코딩 → 지각 해시(dHash)
+# 이미지는 모델에 보내지 않고 캐시 키에만 쓰이므로 재인코딩은 하지 않는다.
+# 다시 저장만 한 거의 같은 사진은 같은 해시가 나와서 같은 캐시 결과를 쓴다
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 15 * 1024 * 1024))
+# 요청 본문 한도: base64 로 4/3 배 커진 이미지 + 나머지 필드 여유분
+MAX_BODY_BYTES = MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 50_000_000))
+# 해시용으로 디코딩할 크기 — dHash 는 9x8 까지 줄이므로 이 정도면 충분하다
+HASH_EDGE = 64
+READ_CHUNK = 64 * 1024
+
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+
+class ImageError(ValueError):
+    status = 400
+
+
+class InvalidImage(ImageError):
+    status = 400
+
+
+class ImageTooLarge(ImageError):
+    status = 413
+
+
+def check_length(size):
+    if size is not None and size > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"upload too large (max {MAX_UPLOAD_BYTES} bytes)")
+
+
+def check_body(content_length):
+    if content_length is not None and content_length > MAX_BODY_BYTES:
+        raise ImageTooLarge(f"upload too large (max {MAX_UPLOAD_BYTES} bytes)")
+
+
+# 스트림을 조각씩 읽다가 한도를 넘는 순간 멈춘다 — 본문 전체를 먼저 버퍼링하지 않는다
+def read_limited(stream) -> bytes:
+    buf = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            return bytes(buf)
+        buf += chunk
+        check_length(len(buf))
+
+
+def decode_base64(image_b64: str) -> bytes:
+    # 디코딩 전에 길이로 먼저 거른다 (base64 는 원본의 4/3 배)
+    check_length(len(image_b64) * 3 // 4)
+    try:
+        return base64.b64decode(image_b64)
+    except (binascii.Error, ValueError):
+        raise InvalidImage("invalid image")
+
+
+def dhash(img, size: int = 8) -> str:
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    # 밝기 변화가 없는 이미지는 dHash 가 전부 0 이라 평균 색(16단계)을 덧붙여 구분한다
+    mean = img.resize((1, 1), Image.BOX).getpixel((0, 0))
+    return f"{bits:0{size * size // 4}x}-" + "".join(f"{c >> 4:x}" for c in mean[:3])
+
+
+# 캐시 키에 넣을 이미지 식별자: 지각 해시가 있으면 "p:...", Pillow 가 없으면 바이트 해시 "s:..."
+def image_id(raw: bytes) -> str:
+    if Image is None:
+        return f"s:{hashlib.sha256(raw).hexdigest()}"
+
+    try:
+        img = Image.open(io.BytesIO(raw))
+        # JPEG 는 DCT 단계에서 최대 1/8 로 줄여서 디코딩한다 (풀 해상도로 풀지 않는다)
+        img.draft("RGB", (HASH_EDGE, HASH_EDGE))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((HASH_EDGE, HASH_EDGE), Image.BILINEAR)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    except Image.DecompressionBombError:
+        raise ImageTooLarge("image has too many pixels")
+    except Exception:
+        logging.debug("이미지 디코딩 실패", exc_info=True)
+        raise InvalidImage("invalid image")
+    return f"p:{dhash(img)}"
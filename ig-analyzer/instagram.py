@@ -0,0 +1,295 @@
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+import upstream
+
+# ——— 인스타그램 프로필 수집 ———
+# keep-alive 커넥션 풀 + 엄격한 타임아웃 + 사용자별 TTL 캐시(stale-while-revalidate)
+# 같은 사용자에 대한 동시 요청은 업스트림 호출 한 번으로 합친다
+# 실패가 이어지면 서킷 브레이커가 열려서 한동안 호출하지 않고 캐시(또는 None)로 답한다
+# 가져오기에 실패한 계정(없는 계정 등)은 negative_ttl 동안 다시 부르지 않고 None 으로 답한다
+
+INSTAGRAM_BASE_URL = os.getenv("INSTAGRAM_BASE_URL", "https://i.instagram.com")
+UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
+)
+
+
+def empty_interactions() -> dict:
+    return {"recent_posts": [], "avg_likes": 0, "recent_comment_texts": []}
+
+
+# 없는 계정(404) 같은 응답은 인스타그램이 살아 있다는 뜻이라 브레이커 실패로 치지 않는다
+def _upstream_fault(e: Exception) -> bool:
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+def _log_fetch_error(username: str, e: Exception):
+    if _upstream_fault(e):
+        logging.error("Instagram 스크래핑 오류:\n%s", traceback.format_exc())
+    else:
+        logging.warning("Instagram 프로필 조회 실패 (%s): %s",
+                        e.response.status_code, username)
+
+
+def parse_profile(user: dict, limit: int = 5) -> dict:
+    interactions = empty_interactions()
+    edges = user["edge_owner_to_timeline_media"]["edges"][:limit]
+    likes = []
+    for edge in edges:
+        node = edge["node"]
+        cap_edges = node.get("edge_media_to_caption", {}).get("edges", [])
+        text = cap_edges[0]["node"]["text"][:100] if cap_edges else ""
+        interactions["recent_posts"].append(text)
+        likes.append(node.get("edge_liked_by", {}).get("count", 0))
+    if likes:
+        interactions["avg_likes"] = sum(likes) // len(likes)
+    return interactions
+
+
+# username -> (fetched_at, interactions) LRU. interactions 가 None 이면 실패 기록(negative)
+# ttl + stale_ttl 이 지난 값과 negative_ttl 이 지난 실패 기록은 꺼낼 때 지운다.
+# 락은 쓰는 쪽(ProfileFetcher)이 잡는다
+class ProfileCache:
+    def __init__(self, ttl: float, stale_ttl: float, negative_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, username: str, now: float):
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        fetched_at, interactions = entry
+        limit = self.negative_ttl if interactions is None else self.ttl + self.stale_ttl
+        if now - fetched_at >= limit:
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return entry
+
+    def set(self, username: str, now: float, interactions: dict):
+        self._entries[username] = (now, interactions)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # 실패는 쓸 수 있는 값이 없을 때만 기록한다 (stale 값은 그대로 둔다)
+    def set_failed(self, username: str, now: float):
+        if self.negative_ttl > 0 and self.get(username, now) is None:
+            self.set(username, now, None)
+
+    def has(self, username: str, now: float) -> bool:
+        entry = self.get(username, now)
+        return entry is not None and entry[1] is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ProfileFetcher:
+    def __init__(self, base_url: str = INSTAGRAM_BASE_URL, limit: int = 5,
+                 ttl: float = 300, stale_ttl: float = 3600,
+                 negative_ttl: float = 30, max_entries: int = 10000,
+                 connect_timeout: float = 3.0, read_timeout: float = 5.0,
+                 pool_size: int = 10, refresh_workers: int = 4,
+                 breaker: upstream.CircuitBreaker = None):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.ttl = ttl
+        self.breaker = breaker or upstream.CircuitBreaker("instagram")
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = UA
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._cache = ProfileCache(ttl, stale_ttl, negative_ttl, max_entries)
+        self._inflight = {}  # username -> Future
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers,
+                                             thread_name_prefix="ig-refresh")
+
+    def _fetch(self, username: str) -> dict:
+        url = f"{self.base_url}/api/v1/users/web_profile_info/"
+        resp = self.session.get(url, params={"username": username}, timeout=self.timeout)
+        resp.raise_for_status()
+        return parse_profile(resp.json()["data"]["user"], self.limit)
+
+    # 같은 username 을 이미 가져오는 중이면 그 결과를 기다리고, 아니면 직접 가져온다
+    def _fetch_coalesced(self, username: str) -> Future:
+        with self._lock:
+            fut = self._inflight.get(username)
+            if fut is not None:
+                return fut
+            fut = Future()
+            self._inflight[username] = fut
+
+        interactions, failed = None, False
+        if self.breaker.allow():
+            try:
+                interactions = self._fetch(username)
+                self.breaker.success()
+            except Exception as e:
+                failed = True
+                _log_fetch_error(username, e)
+                if _upstream_fault(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+        with self._lock:
+            if interactions is not None:
+                self._cache.set(username, time.monotonic(), interactions)
+            elif failed:
+                self._cache.set_failed(username, time.monotonic())
+            del self._inflight[username]
+        fut.set_result(interactions)
+        return fut
+
+    def _refresh_in_background(self, username: str):
+        with self._lock:
+            if username in self._inflight:
+                return
+        self._refresher.submit(self._fetch_coalesced, username)
+
+    # 쓸 수 있는 값이 하나도 없으면 None — 호출 쪽은 지인 정보 없이 진행하고 degraded 로 표시한다
+    def get(self, username: str) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(username, now)
+        if entry is not None:
+            fetched_at, interactions = entry
+            if interactions is None:
+                return None  # 최근에 실패한 계정
+            if now - fetched_at >= self.ttl:
+                self._refresh_in_background(username)
+            return copy.deepcopy(interactions)
+
+        interactions = self._fetch_coalesced(username).result()
+        return copy.deepcopy(interactions)
+
+    # 스크래핑 없이 바로 답할 수 있는지 (stale 이어도 된다)
+    def cached(self, username: str) -> bool:
+        with self._lock:
+            return self._cache.has(username, time.monotonic())
+
+    def cached_usernames(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
+
+# aio.py 용 비동기 버전 — 캐시/합치기 규칙은 ProfileFetcher 와 같다
+class AsyncProfileFetcher:
+    def __init__(self, base_url: str = INSTAGRAM_BASE_URL, limit: int = 5,
+                 ttl: float = 300, stale_ttl: float = 3600,
+                 negative_ttl: float = 30, max_entries: int = 10000,
+                 connect_timeout: float = 3.0, read_timeout: float = 5.0,
+                 pool_size: int = 10, breaker: upstream.CircuitBreaker = None):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.ttl = ttl
+        self.breaker = breaker or upstream.CircuitBreaker("instagram")
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": UA},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size),
+        )
+        self._cache = ProfileCache(ttl, stale_ttl, negative_ttl, max_entries)
+        self._inflight = {}  # username -> asyncio.Task
+
+    async def _fetch(self, username: str) -> dict:
+        url = f"{self.base_url}/api/v1/users/web_profile_info/"
+        try:
+            if not self.breaker.allow():
+                return None
+            resp = await self.client.get(url, params={"username": username})
+            resp.raise_for_status()
+            interactions = parse_profile(resp.json()["data"]["user"], self.limit)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            _log_fetch_error(username, e)
+            if _upstream_fault(e):
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            self._cache.set_failed(username, time.monotonic())
+            return None
+        finally:
+            self._inflight.pop(username, None)
+        self.breaker.success()
+        self._cache.set(username, time.monotonic(), interactions)
+        return interactions
+
+    # 이벤트 루프가 하나라 락 없이 dict 확인만으로 요청을 합칠 수 있다
+    def _fetch_coalesced(self, username: str) -> asyncio.Task:
+        task = self._inflight.get(username)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(username))
+            self._inflight[username] = task
+        return task
+
+    async def get(self, username: str) -> dict:
+        now = time.monotonic()
+        entry = self._cache.get(username, now)
+        if entry is not None:
+            fetched_at, interactions = entry
+            if interactions is None:
+                return None
+            if now - fetched_at >= self.ttl:
+                self._fetch_coalesced(username)
+            return copy.deepcopy(interactions)
+
+        # 호출 쪽이 마감시간으로 취소해도 가져오기는 계속 진행해서 캐시를 채운다
+        interactions = await asyncio.shield(self._fetch_coalesced(username))
+        return copy.deepcopy(interactions)
+
+    def cached(self, username: str) -> bool:
+        return self._cache.has(username, time.monotonic())
+
+    def cached_usernames(self) -> int:
+        return len(self._cache)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _env_kwargs() -> dict:
+    return dict(
+        base_url=INSTAGRAM_BASE_URL,
+        ttl=float(os.getenv("PROFILE_CACHE_TTL", 300)),
+        stale_ttl=float(os.getenv("PROFILE_STALE_TTL", 3600)),
+        negative_ttl=float(os.getenv("PROFILE_NEGATIVE_TTL", 30)),
+        max_entries=int(os.getenv("PROFILE_CACHE_SIZE", 10000)),
+        connect_timeout=float(os.getenv("INSTAGRAM_CONNECT_TIMEOUT", 3)),
+        read_timeout=float(os.getenv("INSTAGRAM_READ_TIMEOUT", 5)),
+        pool_size=int(os.getenv("INSTAGRAM_POOL_SIZE", 10)),
+        breaker=upstream.breaker_from_env("instagram"),
+    )
+
+
+def from_env() -> ProfileFetcher:
+    return ProfileFetcher(**_env_kwargs())
+
+
+def async_from_env() -> AsyncProfileFetcher:
+    return AsyncProfileFetcher(**_env_kwargs())
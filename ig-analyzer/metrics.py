@@ -0,0 +1,189 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# ——— 메트릭 ———
+# Prometheus 텍스트 형식으로 내보내는 가벼운 카운터/히스토그램 (외부 의존성 없음)
+# 값은 프로세스(워커)마다 따로 쌓이므로 gunicorn 워커 여러 개면 각각 긁어가야 한다
+
+# 요청별 단계 시간을 한 줄 JSON 로그로 남길지, 남긴다면 몇 분의 1 만 남길지
+TIMING_LOG = os.getenv("TIMING_LOG", "0") in ("1", "true")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def sampled() -> bool:
+    return random.random() < LOG_SAMPLE_RATE
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # labels -> [버킷별 개수..., 합계, 개수]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                running = 0
+                for bound, count in zip(self.buckets, series):
+                    running += count
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {running}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+REQUESTS = Counter("safepost_requests_total", "처리한 요청 수", ("endpoint", "outcome"))
+REQUEST_SECONDS = Histogram("safepost_request_seconds", "요청 전체 처리 시간",
+                            ("endpoint", "outcome"))
+STAGE_SECONDS = Histogram("safepost_stage_seconds", "단계별 처리 시간", ("endpoint", "stage"))
+TOKENS = Counter("safepost_openai_tokens_total", "OpenAI 토큰 사용량", ("endpoint", "kind"))
+CACHE_EVENTS = Counter("safepost_cache_events_total", "결과 캐시 조회 결과",
+                       ("endpoint", "result"))
+UPSTREAM_EVENTS = Counter("safepost_upstream_events_total", "업스트림 호출 제어 이벤트 (거절/재시도/차단)",
+                          ("upstream", "event"))
+
+REGISTRY = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, TOKENS, CACHE_EVENTS, UPSTREAM_EVENTS]
+
+
+# 요청 하나의 단계 시간을 모은다. 현재 요청은 contextvar 로 찾아서
+# 스크래핑/OpenAI 호출 쪽 코드가 타이머를 인자로 받지 않아도 되게 한다
+class RequestTimer:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.cache = None
+        self.finished = False
+
+    def finish(self, outcome: str):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started
+        REQUESTS.inc(self.endpoint, outcome)
+        REQUEST_SECONDS.observe(elapsed, self.endpoint, outcome)
+        if TIMING_LOG and sampled():
+            logging.info("timing %s", json.dumps({
+                "endpoint": self.endpoint,
+                "outcome": outcome,
+                "total_ms": round(elapsed * 1000, 1),
+                "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+                "tokens": self.tokens,
+                "cache": self.cache,
+            }))
+
+
+_current = contextvars.ContextVar("safepost_request_timer", default=None)
+
+
+def start_request(endpoint: str) -> RequestTimer:
+    timer = RequestTimer(endpoint)
+    _current.set(timer)
+    return timer
+
+
+def current() -> RequestTimer:
+    return _current.get()
+
+
+def _endpoint() -> str:
+    timer = _current.get()
+    return timer.endpoint if timer else "other"
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, _endpoint(), name)
+        timer = _current.get()
+        if timer is not None:
+            timer.stages[name] = timer.stages.get(name, 0) + elapsed
+
+
+def record_usage(usage):
+    if usage is None:
+        return
+    endpoint = _endpoint()
+    timer = _current.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, 0) or 0
+        TOKENS.inc(endpoint, kind.split("_")[0], amount=count)
+        if timer is not None:
+            timer.tokens[kind] = timer.tokens.get(kind, 0) + count
+
+
+def record_cache(result: str):
+    CACHE_EVENTS.inc(_endpoint(), result)
+    timer = _current.get()
+    if timer is not None:
+        timer.cache = result
+
+
+def gauge(name: str, help: str, value) -> list:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+def render(extra: list = ()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += extra
+    return "\n".join(lines) + "\n"
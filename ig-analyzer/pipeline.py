@@ -0,0 +1,508 @@
+import json
+import logging
+import os
+import traceback
+from collections import Counter
+
+import cache
+import imaging
+import instagram
+import metrics
+import schemas
+import upstream
+from prompts import (MODEL, MAX_TOKENS, ANALYZE_PROMPT_VERSION, RISK_PROMPT_VERSION,
+                     ANALYZE_BATCH_PROMPT_VERSION, RISK_BATCH_PROMPT_VERSION,
+                     analyze_messages, risk_messages,
+                     analyze_batch_messages, risk_batch_messages)
+from schemas import AnalyzeResult, RiskResult, AnalyzeBatch, RiskBatch
+
+# ——— 요청 처리 파이프라인 ———
+# app.py(Flask) 와 aio.py(ASGI) 가 같이 쓰는 요청 처리 순서:
+#   본문 해석 → 이미지 식별 → 캐시 키 → 캐시 조회 → 모델 호출 → 캐시 저장 → 응답
+# 핸들러는 제너레이터라서 I/O 가 필요할 때마다 아래 효과(Identify, Complete ...) 객체를 yield 하고,
+# 서버가 그것을 자기 방식(동기/비동기)으로 실행한 결과를 send 로 돌려준다.
+# 실행 중 난 예외는 throw 로 다시 넣어 주므로 핸들러 안의 try/except 가 그대로 동작한다.
+# 엔드포인트 동작은 여기서만 고치고, 서버 쪽은 효과 실행과 응답 전송만 맡는다.
+
+# 배치 요청 한 번에 받을 수 있는 항목 수 / 모델 호출 하나에 묶을 캡션 수 / 동시 호출 수
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 50))
+BATCH_GROUP_SIZE = int(os.getenv("BATCH_GROUP_SIZE", 5))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+
+class BadRequest(ValueError):
+    status = 400
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# ——— 효과 ———
+# 서버가 실행해서 결과를 돌려줘야 하는 일들
+
+# 업로드 이미지의 지각 해시 id. 실행 결과: str
+class Identify:
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+
+# 지인 활동 스냅샷. 실행 결과: usernames 순서대로, 못 가져온 사람은 None
+class FetchProfiles:
+    def __init__(self, usernames: list):
+        self.usernames = usernames
+
+
+# 여러 효과를 (가능하면 동시에) 실행한다. 실행 결과: 순서대로 담은 list
+class Gather:
+    def __init__(self, *effects):
+        self.effects = effects
+
+
+# 결과 캐시 조회. bypass 면 우회로 기록만 한다. 실행 결과: 캐시 값 또는 None
+class CacheGet:
+    def __init__(self, key: str, bypass: bool = False):
+        self.key = key
+        self.bypass = bypass
+
+
+class CacheSet:
+    def __init__(self, key: str, body: dict):
+        self.key = key
+        self.body = body
+
+
+# LLM 입장 사전 점검 (서킷 열림/대기열 가득이면 upstream.Rejected)
+class Check:
+    pass
+
+
+# 지인 정보가 모두 프로필 캐시에 있는지 (스크래핑 없이 바로 나오는지). 실행 결과: bool
+class ProfilesCached:
+    def __init__(self, usernames: list):
+        self.usernames = usernames
+
+
+# 모델 응답 한 번. 실행 결과: 검증된 schema 인스턴스 (형식이 틀리면 schemas.MalformedOutput)
+class Complete:
+    def __init__(self, messages: list, schema, max_tokens: int = MAX_TOKENS):
+        self.messages = messages
+        self.schema = schema
+        self.max_tokens = max_tokens
+
+
+# 스트리밍 호출. 조각마다 delta_events 를 내보내고, 실행 결과는 받은 전체 텍스트
+class StreamTokens:
+    def __init__(self, messages: list, schema, fields: schemas.FieldStream):
+        self.messages = messages
+        self.schema = schema
+        self.fields = fields
+
+
+# 스트리밍 응답 본문에 바로 쓸 텍스트
+class Emit:
+    def __init__(self, text: str):
+        self.text = text
+
+
+# ——— 응답 ———
+
+class Reply:
+    def __init__(self, status: int, body: dict, headers: dict = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+# server-sent events. events 는 Emit 을 내는 파이프라인
+class StreamReply:
+    def __init__(self, events):
+        self.events = events
+
+
+# NDJSON. 서버가 batch_lookup 과 score_chunk 를 돌리면서 줄 단위로 내보낸다
+class BatchReply:
+    def __init__(self, items: list, jobs: list, field: str, schema, batch_schema, bypass: bool):
+        self.items = items
+        self.jobs = jobs
+        self.field = field
+        self.schema = schema
+        self.batch_schema = batch_schema
+        self.bypass = bypass
+
+
+# ——— 요청 본문 ———
+# JSON(base64), multipart/form-data, 또는 image/* 바이너리 본문.
+# 바이너리 본문일 때 나머지 값(caption 등)은 쿼리스트링으로 받는다
+LIST_FIELDS = ("captions", "target_user_ids")
+
+
+def form_fields(values) -> dict:
+    return {k: values.getlist(k) if k in LIST_FIELDS else values.get(k) for k in values}
+
+
+# args 는 werkzeug MultiDict, multipart 는 (form, files) 를 돌려주는 함수 (필요할 때만 파싱한다)
+def read_upload(mimetype: str, args, stream, content_length: int, multipart):
+    imaging.check_body(content_length)
+    if mimetype == "multipart/form-data":
+        form, files = multipart()
+        upload = files.get("image")
+        raw = imaging.read_limited(upload.stream) if upload else None
+        return form_fields(form), raw or None
+    if mimetype.startswith("image/") or mimetype == "application/octet-stream":
+        return form_fields(args), imaging.read_limited(stream) or None
+    try:
+        fields = json.loads(stream.read() or b"{}")
+    except ValueError:
+        raise BadRequest("invalid JSON body")
+    if not isinstance(fields, dict):
+        raise BadRequest("JSON body must be an object")
+    image_b64 = fields.get("image")
+    if image_b64 is not None and not isinstance(image_b64, str):
+        raise imaging.InvalidImage("image must be a base64 string")
+    return fields, imaging.decode_base64(image_b64) if image_b64 else None
+
+
+# JSON 의 true, 또는 쿼리/폼 문자열 "1", "true". "0", "false" 같은 문자열은 거짓이다
+def flag(value) -> bool:
+    return value is True or value in ("1", "true")
+
+
+# 해석한 요청. args/headers 는 소문자 키로 get 할 수 있는 객체
+class Payload:
+    def __init__(self, fields: dict, raw: bytes, args, headers):
+        self.fields = fields
+        self.raw = raw
+        # ?stream=1 또는 Accept: text/event-stream
+        self.stream = (flag(args.get("stream"))
+                       or "text/event-stream" in headers.get("accept", ""))
+        # 요청 단위 캐시 우회: ?nocache=1, Cache-Control: no-cache, 또는 본문의 "no_cache": true
+        self.bypass = (flag(args.get("nocache"))
+                       or "no-cache" in headers.get("cache-control", "")
+                       or flag(fields.get("no_cache")))
+
+
+def client_error(e) -> Reply:
+    return Reply(e.status, {"error": str(e)})
+
+
+def rejected_reply(e: upstream.Rejected) -> Reply:
+    return Reply(e.status, {"error": str(e), "degraded": True},
+                 {"Retry-After": str(e.retry_after)})
+
+
+# 핸들러에서 새어 나온 예외를 응답으로 바꾼다
+def guarded(name: str, steps):
+    try:
+        return (yield from steps)
+    except (imaging.ImageError, BadRequest) as e:
+        return client_error(e)
+    except schemas.MalformedOutput as e:
+        logging.error("모델 응답 형식 오류: %s", e)
+        return Reply(502, {"error": "malformed model output"})
+    except upstream.Rejected as e:
+        return rejected_reply(e)
+    except DeadlineExceeded:
+        return Reply(504, {"error": "deadline exceeded", "degraded": True})
+    except Exception as e:
+        tb = traceback.format_exc()
+        logging.error("%s 오류:\n%s", name, tb)
+        return Reply(500, {"error": str(e), "traceback": tb})
+
+
+# ——— 단건 ———
+
+class Job:
+    def __init__(self, name: str, field: str, schema, messages: list, key: str,
+                 degraded: str = None):
+        self.name = name
+        self.field = field
+        self.schema = schema
+        self.messages = messages
+        self.key = key
+        self.degraded = degraded
+
+    def body(self, result) -> dict:
+        body = {self.field: result.model_dump()}
+        if self.degraded:
+            body.update(degraded=True, degraded_reason=self.degraded)
+        return body
+
+
+def analyze(p: Payload):
+    caption = p.fields.get("caption") or ""
+    if not p.raw:
+        return Reply(400, {"error": "image missing"})
+    image_id = yield Identify(p.raw)
+    key = cache.make_key("analyze", MODEL, ANALYZE_PROMPT_VERSION, caption, image_id)
+    job = Job("analyze", "result", AnalyzeResult, analyze_messages(caption), key)
+    return (yield from answer(job, p))
+
+
+def risk_assess(p: Payload):
+    caption = p.fields.get("caption") or ""
+    target_id = p.fields.get("target_user_id")
+    if not p.raw or not target_id:
+        return Reply(400, {"error": "image or target_user_id missing"})
+    if not isinstance(target_id, str):
+        return Reply(400, {"error": "target_user_id must be a string"})
+    yield from check_before_scrape([target_id])
+    image_id, (interactions,) = yield Gather(Identify(p.raw), FetchProfiles([target_id]))
+    degraded = None
+    if interactions is None:
+        # 스크래핑 실패, 시간 초과, 서킷 열림 — 지인 정보 없이 답하고 결과는 캐시에 넣지 않는다
+        interactions = instagram.empty_interactions()
+        degraded = "friend context unavailable"
+    # 지인 활동이 바뀌면 결과도 달라져야 하므로 스냅샷까지 키에 넣는다
+    key = cache.make_key("risk_assess", MODEL, RISK_PROMPT_VERSION, caption,
+                         image_id, target_id, interactions)
+    job = Job("risk_assess", "risk_assessment", RiskResult,
+              risk_messages(target_id, interactions, caption), key, degraded)
+    return (yield from answer(job, p))
+
+
+# 스크래핑부터 해야 하는 요청은 OpenAI 가 막혀 있으면 기다리기 전에 거절한다.
+# 프로필이 캐시에 있으면 결과 캐시에 맞을 수 있으므로 거절하지 않고 캐시 조회까지 간다
+# (캐시에 없으면 answer/Complete 입장에서 거절된다)
+def check_before_scrape(usernames: list):
+    if not (yield ProfilesCached(usernames)):
+        yield Check()
+
+
+# 스키마에 맞지 않는 응답은 한 번만 다시 묻고, 그래도 틀리면 MalformedOutput
+def complete(messages: list, schema, max_tokens: int = MAX_TOKENS):
+    try:
+        return (yield Complete(messages, schema, max_tokens))
+    except schemas.MalformedOutput:
+        logging.warning("%s 형식 오류, 다시 요청", schema.__name__)
+    return (yield Complete(messages, schema, max_tokens))
+
+
+def answer(job: Job, p: Payload):
+    status = "BYPASS" if p.bypass else "MISS"
+    hit = None if job.degraded else (yield CacheGet(job.key, p.bypass))
+    if hit is not None:
+        if p.stream:
+            return StreamReply(cached_events(hit, job.field))
+        return Reply(200, hit, {"X-Cache": "HIT"})
+    try:
+        if p.stream:
+            yield Check()
+            return StreamReply(stream_events(job, status))
+        result = yield from complete(job.messages, job.schema)
+    except upstream.Rejected as e:
+        return (yield from rejected(e, job.key, p.bypass))
+    if metrics.sampled():
+        logging.debug("%s 응답: %s", job.name, result)
+    body = job.body(result)
+    if job.degraded:
+        return Reply(200, body, {"X-Cache": "MISS"})
+    yield CacheSet(job.key, body)
+    return Reply(200, body, {"X-Cache": status})
+
+
+# 입장 거절(대기열 가득/예산 초과/서킷 열림). 캐시 우회 요청이었다면 캐시에 남은 결과라도 돌려준다
+def rejected(e: upstream.Rejected, key: str, bypass: bool):
+    hit = (yield CacheGet(key)) if bypass else None
+    if hit is not None:
+        return Reply(200, dict(hit, degraded=True), {"X-Cache": "HIT"})
+    return rejected_reply(e)
+
+
+# ——— 스트리밍 (server-sent events) ———
+# 토큰을 그대로 흘려보내고, JSON 필드 값이 하나 끝날 때마다 field 이벤트로 먼저 보낸다
+# (점수가 답변 전체보다 먼저 보인다)
+# 스트림 결과가 검증에 실패해 다시 물으면 reset 이벤트 뒤에 검증된 field 를 전부 다시 보낸다
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def delta_events(delta: str, fields: schemas.FieldStream) -> list:
+    events = [sse("token", {"text": delta})]
+    for name, value in fields.feed(delta):
+        events.append(sse("field", {"name": name, "value": value}))
+    return events
+
+
+def stream_events(job: Job, cache_status: str):
+    fields = schemas.FieldStream()
+    try:
+        # 토큰을 이미 내보낸 뒤에는 다시 시도할 수 없으므로 스트리밍은 재시도 없이 한 번만 부른다
+        text = yield StreamTokens(job.messages, job.schema, fields)
+        try:
+            result = schemas.validate(job.schema, text)
+        except schemas.MalformedOutput:
+            # 스트림으로 받은 결과가 틀렸으면 스트리밍 없이 한 번 더 묻는다
+            logging.warning("%s 형식 오류, 다시 요청", job.schema.__name__)
+            result = yield Complete(job.messages, job.schema)
+            # 이미 보낸 field 는 검증 안 된 값이었으므로 버리라고 알리고 전부 다시 보낸다
+            fields.reset()
+            yield Emit(sse("reset", {}))
+        for name, value in fields.finish(result):
+            yield Emit(sse("field", {"name": name, "value": value}))
+    except upstream.Rejected as e:
+        yield Emit(sse("error", {"error": str(e), "degraded": True,
+                                 "retry_after": e.retry_after}))
+        return
+    except Exception as e:
+        logging.error("스트리밍 오류:\n%s", traceback.format_exc())
+        yield Emit(sse("error", {"error": str(e)}))
+        return
+    body = job.body(result)
+    if not job.degraded:
+        yield CacheSet(job.key, body)
+    yield Emit(sse("done", dict(body, cache=cache_status)))
+
+
+def cached_events(body: dict, field: str):
+    for name, value in body[field].items():
+        yield Emit(sse("field", {"name": name, "value": value}))
+    yield Emit(sse("done", dict(body, cache="HIT")))
+
+
+# ——— 배치 ———
+# 캡션 여러 개(risk_assess 는 지인 여러 명까지)를 받아 NDJSON 으로 항목마다 한 줄씩 흘려보낸다.
+# 캐시에 없는 캡션만 BATCH_GROUP_SIZE 개씩 묶어 한 번에 묻고, 묶음들은 동시에 돌린다.
+
+def ndjson_line(obj: dict) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+# 지인 목록은 target_user_ids(목록) 또는 target_user_id(하나)로 받는다 (with_targets=True 일 때만)
+def parse_batch(fields: dict, raw: bytes, with_targets: bool = False):
+    captions = fields.get("captions")
+    if not raw or not isinstance(captions, list) or not captions:
+        return None, None, "image or captions missing"
+    if not all(isinstance(c, str) for c in captions):
+        return None, None, "captions must be strings"
+    target_ids = None
+    if with_targets:
+        target_ids = fields.get("target_user_ids")
+        if target_ids is None and fields.get("target_user_id") is not None:
+            target_ids = [fields["target_user_id"]]
+        if not target_ids:
+            return None, None, "target_user_ids missing"
+        if not isinstance(target_ids, list) or not all(isinstance(t, str) and t for t in target_ids):
+            return None, None, "target_user_ids must be a list of non-empty strings"
+        target_ids = list(dict.fromkeys(target_ids))
+    return captions, target_ids, None
+
+
+def analyze_batch(p: Payload):
+    captions, _, error = parse_batch(p.fields, p.raw)
+    if error:
+        return Reply(400, {"error": error})
+    if len(captions) > BATCH_MAX_ITEMS:
+        return Reply(400, {"error": f"too many items (max {BATCH_MAX_ITEMS})"})
+    image_id = yield Identify(p.raw)
+
+    items = [{
+        "out": {"index": i, "caption": caption},
+        "caption": caption,
+        "group": 0,
+        "key": cache.make_key("analyze_batch", MODEL, ANALYZE_BATCH_PROMPT_VERSION,
+                              caption, image_id),
+    } for i, caption in enumerate(captions)]
+    jobs = [(analyze_messages, analyze_batch_messages)]
+    return BatchReply(items, jobs, "result", AnalyzeResult, AnalyzeBatch, p.bypass)
+
+
+def risk_assess_batch(p: Payload):
+    captions, target_ids, error = parse_batch(p.fields, p.raw, with_targets=True)
+    if error:
+        return Reply(400, {"error": error})
+    if len(captions) * len(target_ids) > BATCH_MAX_ITEMS:
+        return Reply(400, {"error": f"too many items (max {BATCH_MAX_ITEMS})"})
+    yield from check_before_scrape(target_ids)
+    # 지인 정보는 사람마다 한 번씩, 동시에 가져온다
+    image_id, snapshots = yield Gather(Identify(p.raw), FetchProfiles(target_ids))
+
+    items, jobs = [], []
+    for group, (target_id, interactions) in enumerate(zip(target_ids, snapshots)):
+        degraded = interactions is None
+        if degraded:
+            interactions = instagram.empty_interactions()
+        jobs.append((
+            lambda c, t=target_id, s=interactions: risk_messages(t, s, c),
+            lambda cs, t=target_id, s=interactions: risk_batch_messages(t, s, cs),
+        ))
+        for caption in captions:
+            out = {"index": len(items), "target_user_id": target_id, "caption": caption}
+            items.append({
+                "out": dict(out, degraded=True) if degraded else out,
+                "caption": caption,
+                "group": group,
+                # key 가 없는 항목(지인 정보 없이 채점하는 degraded 항목)은 캐시를 쓰지 않는다
+                "key": None if degraded else cache.make_key(
+                    "risk_assess_batch", MODEL, RISK_BATCH_PROMPT_VERSION, caption,
+                    image_id, target_id, interactions),
+            })
+    return BatchReply(items, jobs, "risk_assessment", RiskResult, RiskBatch, p.bypass)
+
+
+# 캐시 적중 줄과, 모델에 물어볼 묶음(chunk) 목록을 돌려준다
+def batch_lookup(batch: BatchReply):
+    lines, pending = [], {}
+    for item in batch.items:
+        hit = (yield CacheGet(item["key"], batch.bypass)) if item["key"] else None
+        if hit is not None:
+            lines.append(ndjson_line(dict(item["out"], cache="HIT", **hit)))
+        else:
+            pending.setdefault(item["group"], []).append(item)
+    chunks = [group_items[i:i + BATCH_GROUP_SIZE]
+              for group_items in pending.values()
+              for i in range(0, len(group_items), BATCH_GROUP_SIZE)]
+    return lines, chunks
+
+
+# 한 묶음을 모델 호출 한 번으로 채점하고 결과 줄을 돌려준다.
+# 응답은 순서가 아니라 index(프롬프트의 캡션 번호)로 맞추고,
+# 빠졌거나 두 번 나온 번호의 캡션만 단건으로 다시 묻는다
+def score_chunk(batch: BatchReply, chunk: list):
+    single_messages, batch_messages = batch.jobs[chunk[0]["group"]]
+    if len(chunk) == 1:
+        scored = [(yield from complete(single_messages(chunk[0]["caption"]), batch.schema))]
+    else:
+        captions = [item["caption"] for item in chunk]
+        result = yield from complete(batch_messages(captions), batch.batch_schema,
+                                     MAX_TOKENS * len(chunk))
+        counts = Counter(r.index for r in result.items)
+        by_index = {r.index: batch.schema.model_validate(r.model_dump(exclude={"index"}))
+                    for r in result.items if counts[r.index] == 1}
+        scored = []
+        for i, item in enumerate(chunk, 1):
+            if i not in by_index:
+                by_index[i] = yield from complete(single_messages(item["caption"]), batch.schema)
+            scored.append(by_index[i])
+
+    lines = []
+    for item, result in zip(chunk, scored):
+        body = {batch.field: result.model_dump()}
+        if item["key"]:
+            yield CacheSet(item["key"], body)
+        lines.append(ndjson_line(dict(item["out"], cache="BYPASS" if batch.bypass else "MISS",
+                                      **body)))
+    return lines
+
+
+def chunk_error(chunk: list, e: Exception) -> list:
+    if isinstance(e, upstream.Rejected):
+        return [ndjson_line(dict(item["out"], error=str(e), degraded=True,
+                                 retry_after=e.retry_after)) for item in chunk]
+    if isinstance(e, DeadlineExceeded):
+        return [ndjson_line(dict(item["out"], error="deadline exceeded", degraded=True))
+                for item in chunk]
+    logging.error("배치 호출 오류:\n%s", "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+    return [ndjson_line(dict(item["out"], error=str(e))) for item in chunk]
+
+
+# ——— /metrics ———
+
+def gauges(result_cache: cache.ResultCache, profiles, llm) -> list:
+    return (metrics.gauge("safepost_result_cache_entries", "메모리 캐시 항목 수",
+                          result_cache.stats()["entries"])
+            + metrics.gauge("safepost_profile_cache_entries", "지인 프로필 캐시 항목 수",
+                            profiles.cached_usernames())
+            + llm.gauges()
+            + profiles.breaker.gauges())
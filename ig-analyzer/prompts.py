@@ -0,0 +1,69 @@
+# ——— 모델 프롬프트 ———
+# 동기(app.py)와 비동기(aio.py) 서버가 같은 프롬프트를 쓰도록 한곳에 모아둔다
+# 출력 형식은 schemas.py 의 JSON schema 가 강제하므로 프롬프트에는 내용만 적는다
+
+MODEL = "gpt-4o"
+MAX_TOKENS = 150
+
+# 프롬프트 문구나 스키마를 바꾸면 버전도 올려서 이전 캐시를 무효화한다
+ANALYZE_PROMPT_VERSION = "analyze-v3"
+RISK_PROMPT_VERSION = "risk-v3"
+# 묶음 프롬프트로 채점한 결과는 단건 결과와 캐시를 나눠 쓴다
+ANALYZE_BATCH_PROMPT_VERSION = "analyze-batch-v1"
+RISK_BATCH_PROMPT_VERSION = "risk-batch-v1"
+
+ANALYZE_SYSTEM = "당신은 인스타그램 감성 분석 도우미입니다. 한국어로 짧게 답하세요."
+RISK_SYSTEM = "당신은 인스타 지인 반응 리스크 평가 전문가입니다. 영어 사용 금지, 짧게 답하세요."
+
+
+def _friend_context(target_id: str, interactions: dict) -> str:
+    return f"""지인({target_id})의 최근 활동:
+- 최근 게시물 요약: {interactions['recent_posts']}
+- 평균 좋아요 수: {interactions['avg_likes']}"""
+
+
+def analyze_messages(caption: str) -> list:
+    prompt = f"""아래 게시물(이미지+캡션)을 사람들이 싫어하지 않을 확률, 경고, 추천으로 평가해.
+캡션: {caption}"""
+    return [
+        {"role": "system", "content": ANALYZE_SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def risk_messages(target_id: str, interactions: dict, caption: str) -> list:
+    prompt = f"""{_friend_context(target_id, interactions)}
+아래 게시물(이미지+캡션)을 이 지인이 싫어하지 않을 확률, 민감포인트, 공개범위추천으로 평가해.
+캡션: {caption}"""
+    return [
+        {"role": "system", "content": RISK_SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
+
+
+# ——— 배치 프롬프트 ———
+# 캡션 여러 개를 한 번의 호출로 평가한다. 결과 items 는 index(캡션 번호)로 캡션과 맞춘다
+
+def _numbered_captions(captions: list) -> str:
+    return "\n".join(f"[{i}] 캡션: {c}" for i, c in enumerate(captions, 1))
+
+
+def analyze_batch_messages(captions: list) -> list:
+    prompt = f"""같은 이미지에 붙일 캡션 후보 {len(captions)}개를 각각 사람들이 싫어하지 않을 확률, 경고, 추천으로 평가해.
+캡션마다 items 에 하나씩 넣고, 각 항목의 index 에 그 캡션의 번호를 적어.
+{_numbered_captions(captions)}"""
+    return [
+        {"role": "system", "content": ANALYZE_SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def risk_batch_messages(target_id: str, interactions: dict, captions: list) -> list:
+    prompt = f"""{_friend_context(target_id, interactions)}
+같은 이미지에 붙일 캡션 후보 {len(captions)}개를 각각 이 지인이 싫어하지 않을 확률, 민감포인트, 공개범위추천으로 평가해.
+캡션마다 items 에 하나씩 넣고, 각 항목의 index 에 그 캡션의 번호를 적어.
+{_numbered_captions(captions)}"""
+    return [
+        {"role": "system", "content": RISK_SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
@@ -0,0 +1,107 @@
+from functools import lru_cache
+from typing import Annotated, List, Literal
+
+import jiter
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field, ValidationError
+
+# ——— 구조화된 결과 스키마 ———
+# 모델에는 JSON schema(strict) 로 형식을 강제하고, 받은 응답은 pydantic 으로 한 번 더 검증한다
+
+
+class StrictModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+# 범위 제약은 strict schema 가 지원하지 않아서 검증 단계에서 확인한다
+def _percent(v: int) -> int:
+    if not 0 <= v <= 100:
+        raise ValueError("probability must be 0~100")
+    return v
+
+
+Probability = Annotated[int, AfterValidator(_percent)]
+
+
+class AnalyzeResult(StrictModel):
+    probability: Probability = Field(description="사람들이 싫어하지 않을 확률 (0~100)")
+    warning: str = Field(description="위험도에 대한 짧고 구체적인 경고")
+    recommendation: str = Field(description="개선을 위한 짧고 구체적인 추천")
+
+
+class RiskResult(StrictModel):
+    probability: Probability = Field(description="이 지인이 싫어하지 않을 확률 (0~100)")
+    sensitive_points: str = Field(description="이 지인에게 민감할 수 있는 포인트")
+    visibility: Literal["전체공개", "친구공개", "비공개"] = Field(description="공개범위 추천")
+
+
+# 배치 응답의 각 항목은 어느 캡션에 대한 것인지 번호를 같이 돌려받는다 (순서는 믿지 않는다)
+class AnalyzeBatchItem(AnalyzeResult):
+    index: int = Field(description="평가한 캡션의 번호 ([1], [2] ...)")
+
+
+class RiskBatchItem(RiskResult):
+    index: int = Field(description="평가한 캡션의 번호 ([1], [2] ...)")
+
+
+class AnalyzeBatch(StrictModel):
+    items: List[AnalyzeBatchItem]
+
+
+class RiskBatch(StrictModel):
+    items: List[RiskBatchItem]
+
+
+class MalformedOutput(Exception):
+    pass
+
+
+# 스키마는 요청마다 다시 만들 필요가 없다
+@lru_cache(maxsize=None)
+def response_format(model) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "strict": True,
+            "schema": model.model_json_schema(),
+        },
+    }
+
+
+def validate(model, text: str):
+    try:
+        return model.model_validate_json(text or "")
+    except ValidationError as e:
+        raise MalformedOutput(str(e)) from e
+
+
+# 스트리밍 중인 JSON 에서 값이 다 나온 필드를 골라낸다.
+# 객체는 앞에서부터 순서대로 쓰이므로, 마지막 키가 아닌 필드는 값이 끝난 것이다
+class FieldStream:
+    def __init__(self):
+        self._buf = ""
+        self._sent = set()
+
+    def feed(self, text: str) -> list:
+        self._buf += text
+        try:
+            partial = jiter.from_json(self._buf.encode(), partial_mode="trailing-strings")
+        except ValueError:
+            return []
+        if not isinstance(partial, dict):
+            return []
+        return self._take(list(partial.items())[:-1])
+
+    # 검증에 실패해서 다시 물었을 때 — 지금까지 보낸 필드는 없던 것으로 한다
+    def reset(self):
+        self._buf = ""
+        self._sent.clear()
+
+    # 검증이 끝난 최종 결과에서 아직 안 보낸 필드를 마저 보낸다
+    def finish(self, result: BaseModel) -> list:
+        return self._take(list(result.model_dump().items()))
+
+    def _take(self, items: list) -> list:
+        out = [(k, v) for k, v in items if k not in self._sent]
+        self._sent.update(k for k, _ in out)
+        return out
@@ -0,0 +1,148 @@
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+
+import aio
+
+# ASGI 앱을 httpx.ASGITransport 로 부른다. 업스트림은 conftest 가 띄운 가짜 서버.
+# 스케줄러와 httpx 클라이언트가 처음 쓴 이벤트 루프에 묶이므로 모듈 전체가 루프 하나를 같이 쓴다
+
+
+class Client:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=aio.app),
+                                      base_url="http://aio")
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return self.loop.run_until_complete(self.http.request(method, url, **kwargs))
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("POST", url, **kwargs)
+
+    # 응답 뒤에도 도는 작업(마감시간 뒤의 스크래핑 등)이 끝나도록 루프를 돌려준다
+    def sleep(self, seconds: float):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    # 본문 없이 헤더만 정해서 app 을 직접 부른다
+    def raw(self, method: str, path: str, headers: list) -> tuple:
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+                 "headers": headers}
+        self.loop.run_until_complete(aio.app(scope, receive, send))
+        return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+    def close(self):
+        self.loop.run_until_complete(self.http.aclose())
+        self.loop.close()
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = Client()
+    yield client
+    client.close()
+
+
+def payload(image: bytes, **fields) -> dict:
+    return dict(image=base64.b64encode(image).decode(), **fields)
+
+
+def events(resp: httpx.Response) -> list:
+    parsed = []
+    for block in resp.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def test_json_multipart_and_raw_uploads_share_the_cache(client, image):
+    body = client.post("/analyze", json=payload(image, caption="upload"))
+    form = client.post("/analyze", files={"image": ("a.jpg", image, "image/jpeg")},
+                       data={"caption": "upload"})
+    raw = client.post("/analyze?caption=upload", content=image,
+                      headers={"content-type": "image/jpeg"})
+    assert [r.status_code for r in (body, form, raw)] == [200, 200, 200]
+    assert [r.headers["x-cache"] for r in (body, form, raw)] == ["MISS", "HIT", "HIT"]
+    assert raw.json() == body.json()
+
+
+def test_invalid_json_is_rejected(client):
+    resp = client.post("/analyze", content=b"{bad", headers={"content-type": "application/json"})
+    assert resp.status_code == 400
+    assert resp.json() == {"error": "invalid JSON body"}
+
+
+@pytest.mark.parametrize("value", [b"abc", b"-1"])
+def test_bad_content_length_is_rejected(client, value):
+    status, _, body = client.raw("POST", "/analyze", [(b"content-length", value)])
+    assert status == 400
+    assert json.loads(body) == {"error": "invalid content-length"}
+
+
+def test_preflight_allows_request_headers(client):
+    _, headers, _ = client.raw("OPTIONS", "/risk_assess", [])
+    allowed = headers[b"access-control-allow-headers"].decode()
+    assert {"Content-Type", "X-Deadline", "Cache-Control"} <= set(allowed.split(", "))
+
+
+@pytest.mark.parametrize("deadline", ["abc", 0, -1, "nan", [1]])
+def test_bad_deadline_is_rejected(client, image, deadline):
+    resp = client.post("/analyze", json=payload(image, caption="deadline", deadline=deadline))
+    assert resp.status_code == 400
+
+
+def test_deadline_exceeded_is_504(client, image, openai_stub):
+    openai_stub.latency = 0.5
+    resp = client.post("/analyze", json=payload(image, caption="slow"),
+                       headers={"x-deadline": "0.2"})
+    assert resp.status_code == 504
+    assert resp.json() == {"error": "deadline exceeded", "degraded": True}
+
+
+def test_slow_scrape_is_answered_without_friend_context(client, image, instagram_stub):
+    instagram_stub.latency = 0.5
+    body = payload(image, caption="slow scrape", target_user_id="slowpoke", deadline=1)
+    resp = client.post("/risk_assess", json=body)
+    assert resp.status_code == 200
+    assert resp.json()["degraded_reason"] == "friend context unavailable"
+
+    # 기다리기를 그만둔 뒤에도 스크래핑은 끝까지 가서 캐시를 채운다
+    client.sleep(0.5)
+    resp = client.post("/risk_assess", json=body)
+    assert "degraded" not in resp.json()
+
+
+def test_stream_sends_fields_then_done(client, image):
+    resp = client.post("/analyze?stream=1", json=payload(image, caption="stream"))
+    assert resp.headers["content-type"] == "text/event-stream"
+    names = [name for name, _ in events(resp)]
+    assert names[0] == "token"
+    assert names.count("field") == 3
+    assert names[-1] == "done"
+
+    cached = events(client.post("/analyze", json=payload(image, caption="stream"),
+                                headers={"accept": "text/event-stream"}))
+    assert [name for name, _ in cached] == ["field"] * 3 + ["done"]
+    assert cached[-1][1]["cache"] == "HIT"
+
+
+def test_risk_batch_streams_one_line_per_item(client, image):
+    body = payload(image, captions=["batch a", "batch b"], target_user_ids=["amy", "bob"])
+    resp = client.post("/risk_assess/batch", json=body)
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    items = sorted((json.loads(line) for line in resp.text.splitlines()),
+                   key=lambda item: item["index"])
+    assert [(item["target_user_id"], item["caption"]) for item in items] == [
+        ("amy", "batch a"), ("amy", "batch b"), ("bob", "batch a"), ("bob", "batch b")]
+    assert all("risk_assessment" in item for item in items)
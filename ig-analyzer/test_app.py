@@ -0,0 +1,163 @@
+import base64
+import io
+import json
+
+import pytest
+
+import app
+import pipeline
+import schemas
+
+# Flask 앱을 test_client 로 부른다. 업스트림은 conftest 가 띄운 가짜 서버
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def llm_breaker():
+    yield app.llm.breaker
+    app.llm.breaker.success()
+
+
+def payload(image: bytes, **fields) -> dict:
+    return dict(image=base64.b64encode(image).decode(), **fields)
+
+
+def events(resp) -> list:
+    parsed = []
+    for block in resp.get_data(as_text=True).strip().split("\n\n"):
+        event, data = block.split("\n")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def ndjson(resp) -> list:
+    return sorted((json.loads(line) for line in resp.get_data(as_text=True).splitlines()),
+                  key=lambda item: item["index"])
+
+
+def test_analyze_json_then_cache_hit(client, image):
+    first = client.post("/analyze", json=payload(image, caption="json"))
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    assert set(first.json["result"]) == {"probability", "warning", "recommendation"}
+    again = client.post("/analyze", json=payload(image, caption="json"))
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.json == first.json
+
+
+def test_multipart_and_raw_uploads_share_the_cache(client, image):
+    form = client.post("/analyze", data={"image": (io.BytesIO(image), "a.jpg"), "caption": "form"},
+                       content_type="multipart/form-data")
+    raw = client.post("/analyze?caption=form", data=image, content_type="image/jpeg")
+    body = client.post("/analyze", json=payload(image, caption="form"))
+    assert [r.status_code for r in (form, raw, body)] == [200, 200, 200]
+    assert [r.headers["X-Cache"] for r in (form, raw, body)] == ["MISS", "HIT", "HIT"]
+
+
+@pytest.mark.parametrize("value, status", [("0", "HIT"), ("false", "HIT"), ("1", "BYPASS")])
+def test_form_no_cache_flag(client, image, value, status):
+    def post(no_cache=None):
+        data = {"image": (io.BytesIO(image), "a.jpg"), "caption": "no_cache"}
+        if no_cache is not None:
+            data["no_cache"] = no_cache
+        return client.post("/analyze", data=data, content_type="multipart/form-data")
+
+    post()
+    assert post(value).headers["X-Cache"] == status
+
+
+def test_invalid_json_is_rejected(client):
+    resp = client.post("/analyze", data=b"{bad", content_type="application/json")
+    assert resp.status_code == 400
+    assert resp.json == {"error": "invalid JSON body"}
+
+
+def test_stream_sends_fields_then_done(client, image):
+    resp = client.post("/analyze?stream=1", json=payload(image, caption="stream"))
+    assert resp.mimetype == "text/event-stream"
+    names = [name for name, _ in events(resp)]
+    assert names[0] == "token"
+    assert names.count("field") == 3
+    assert names[-1] == "done"
+    assert events(resp)[-1][1]["cache"] == "MISS"
+
+    # 캐시 적중은 토큰 없이 field 와 done 만 보낸다
+    cached = events(client.post("/analyze?stream=1", json=payload(image, caption="stream")))
+    assert [name for name, _ in cached] == ["field"] * 3 + ["done"]
+    assert cached[-1][1]["cache"] == "HIT"
+
+
+def test_malformed_output_is_asked_again(client, image, monkeypatch):
+    calls = []
+    complete = app.EFFECTS[pipeline.Complete]
+
+    def flaky(effect):
+        calls.append(effect)
+        if len(calls) == 1:
+            raise schemas.MalformedOutput("bad")
+        return complete(effect)
+
+    monkeypatch.setitem(app.EFFECTS, pipeline.Complete, flaky)
+    assert client.post("/analyze", json=payload(image, caption="retry")).status_code == 200
+    assert len(calls) == 2
+
+    def malformed(effect):
+        calls.append(effect)
+        return schemas.validate(effect.schema, "not json")
+
+    calls.clear()
+    monkeypatch.setitem(app.EFFECTS, pipeline.Complete, malformed)
+    resp = client.post("/analyze", json=payload(image, caption="retry twice"))
+    assert resp.status_code == 502
+    assert len(calls) == 2
+
+
+def test_missing_profile_is_answered_without_friend_context(client, image, instagram_stub):
+    instagram_stub.missing.add("ghost")
+    body = payload(image, caption="degraded", target_user_id="ghost")
+    resp = client.post("/risk_assess", json=body)
+    assert resp.status_code == 200
+    assert resp.json["degraded"] is True
+    assert resp.json["degraded_reason"] == "friend context unavailable"
+    # degraded 결과는 캐시에 넣지 않는다
+    assert client.post("/risk_assess", json=body).headers["X-Cache"] == "MISS"
+
+
+def test_batch_streams_one_line_per_item(client, image):
+    body = payload(image, captions=["batch 1", "batch 2", "batch 3"])
+    resp = client.post("/analyze/batch", json=body)
+    assert resp.mimetype == "application/x-ndjson"
+    items = ndjson(resp)
+    assert [item["index"] for item in items] == [0, 1, 2]
+    assert all(item["cache"] == "MISS" and "result" in item for item in items)
+    assert all(item["cache"] == "HIT" for item in ndjson(client.post("/analyze/batch", json=body)))
+
+
+def test_cached_risk_assess_is_served_while_breaker_is_open(client, image, llm_breaker):
+    single = payload(image, caption="breaker", target_user_id="amy")
+    batch = payload(image, captions=["breaker"], target_user_ids=["amy"])
+    assert client.post("/risk_assess", json=single).status_code == 200
+    assert client.post("/risk_assess/batch", json=batch).status_code == 200
+
+    for _ in range(llm_breaker.failures):
+        llm_breaker.failure()
+    resp = client.post("/risk_assess", json=single)
+    assert (resp.status_code, resp.headers["X-Cache"]) == (200, "HIT")
+    assert [item["cache"] for item in ndjson(client.post("/risk_assess/batch", json=batch))] \
+        == ["HIT"]
+
+    miss = client.post("/risk_assess", json=dict(single, caption="breaker miss"))
+    assert miss.status_code == 503
+    assert int(miss.headers["Retry-After"]) > 0
+
+
+def test_exhausted_upstream_is_a_degraded_error(client, image, openai_stub, llm_breaker):
+    openai_stub.error_rate = 1.0
+    resp = client.post("/analyze", json=payload(image, caption="exhausted"))
+    assert resp.status_code in (429, 503)
+    assert resp.json["degraded"] is True
+    assert "Retry-After" in resp.headers
@@ -0,0 +1,60 @@
+import sqlite3
+
+import cache
+from cache import ResultCache, make_key
+
+
+def test_make_key_is_stable_and_length_prefixed():
+    assert make_key("a", 1, {"x": [1, 2]}) == make_key("a", 1, {"x": [1, 2]})
+    assert make_key("ab", "c") != make_key("a", "bc")
+    # dict 는 키 순서와 상관없이 같은 키
+    assert make_key({"a": 1, "b": 2}) == make_key({"b": 2, "a": 1})
+    assert make_key(None) == make_key("") == make_key(b"")
+
+
+def test_lru_evicts_least_recently_used():
+    c = ResultCache(max_entries=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a 가 최근 사용으로 올라간다
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+    assert c.stats()["entries"] == 2
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    c = ResultCache(ttl=10)
+    c.set("k", {"v": 1})
+    now[0] += 9
+    assert c.get("k") == {"v": 1}
+    now[0] += 2
+    assert c.get("k") is None
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 0)
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    db = str(tmp_path / "results.db")
+    ResultCache(db_path=db).set("k", {"result": {"probability": 3}})
+    fresh = ResultCache(db_path=db)
+    assert fresh.get("k") == {"result": {"probability": 3}}
+    assert fresh.stats()["disk_hits"] == 1
+    # 두 번째부터는 메모리에서 찾는다
+    assert fresh.get("k") == {"result": {"probability": 3}}
+    assert fresh.stats()["hits"] == 1
+
+
+def test_disk_prune_runs_every_n_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "PRUNE_EVERY", 10)
+    db = str(tmp_path / "results.db")
+    c = ResultCache(db_path=db, disk_ttl=-1)
+    for i in range(25):
+        c.set(f"k{i}", i)
+    rows = sqlite3.connect(db).execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    # 10, 20 번째 쓰기에서 그때까지의 만료 행을 지웠으므로 그 뒤에 쓴 5개만 남는다
+    assert rows == 5
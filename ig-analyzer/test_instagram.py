@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import upstream
+from bench import fakes
+from instagram import AsyncProfileFetcher, ProfileFetcher
+
+# 가짜 인스타그램(bench.fakes) 을 띄워서 실제 HTTP 로 가져온다
+
+
+@pytest.fixture
+def stub():
+    server, url = fakes.start_instagram(latency=0.05)
+    server.url = url
+    server.upstream = server.RequestHandlerClass.upstream
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(cond, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_get_parses_profile(stub):
+    interactions = ProfileFetcher(stub.url).get("amy")
+    assert interactions["recent_posts"][0] == "amy 의 게시물 0"
+    assert len(interactions["recent_posts"]) == 5
+    assert isinstance(interactions["avg_likes"], int)
+
+
+def test_fresh_entry_is_served_from_cache(stub):
+    fetcher = ProfileFetcher(stub.url)
+    first = fetcher.get("amy")
+    first["recent_posts"].clear()  # 돌려준 값을 고쳐도 캐시는 그대로
+    assert fetcher.get("amy")["recent_posts"]
+    assert stub.upstream.requests == 1
+    assert fetcher.cached_usernames() == 1
+
+
+def test_concurrent_gets_are_coalesced(stub):
+    stub.upstream.latency = 0.3
+    fetcher = ProfileFetcher(stub.url)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetcher.get("amy")))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8
+    assert all(r == results[0] for r in results)
+    assert stub.upstream.requests == 1
+
+
+def test_stale_entry_is_served_while_revalidating(stub):
+    fetcher = ProfileFetcher(stub.url, ttl=0, stale_ttl=60)
+    fetcher.get("amy")
+    stub.upstream.latency = 0.5
+    started = time.monotonic()
+    assert fetcher.get("amy") is not None
+    # 오래된 값은 기다리지 않고 바로 돌려주고, 새로 가져오기는 뒤에서 돈다
+    assert time.monotonic() - started < 0.3
+    wait_for(lambda: stub.upstream.requests == 2)
+
+
+def test_failed_refresh_keeps_stale_entry(stub):
+    fetcher = ProfileFetcher(stub.url, ttl=0, stale_ttl=60)
+    cached = fetcher.get("amy")
+    stub.upstream.error_rate = 1.0
+    assert fetcher.get("amy") == cached
+    wait_for(lambda: stub.upstream.requests == 2)
+    assert fetcher.get("amy") == cached
+    assert fetcher.get("bob") is None
+
+
+def test_entry_past_stale_window_is_dropped(stub):
+    fetcher = ProfileFetcher(stub.url, ttl=0, stale_ttl=0, negative_ttl=0)
+    fetcher.get("amy")
+    assert not fetcher.cached("amy")
+    stub.upstream.error_rate = 1.0
+    # 너무 오래된 값은 실패했을 때도 돌려주지 않는다
+    assert fetcher.get("amy") is None
+    assert fetcher.cached_usernames() == 0
+
+
+def test_cache_is_capped_lru(stub):
+    fetcher = ProfileFetcher(stub.url, max_entries=2)
+    fetcher.get("a")
+    fetcher.get("b")
+    fetcher.get("a")  # a 가 최근 사용으로 올라간다
+    fetcher.get("c")
+    assert fetcher.cached_usernames() == 2
+    assert fetcher.cached("a") and fetcher.cached("c")
+    assert not fetcher.cached("b")
+
+
+def test_failed_fetch_is_negatively_cached(stub):
+    stub.upstream.missing.add("ghost")
+    fetcher = ProfileFetcher(stub.url, negative_ttl=0.2)
+    assert fetcher.get("ghost") is None
+    assert fetcher.get("ghost") is None
+    assert stub.upstream.requests == 1
+    assert not fetcher.cached("ghost")
+    # 없는 계정은 인스타그램 장애가 아니다
+    assert not fetcher.breaker.is_open()
+
+    stub.upstream.missing.clear()
+    time.sleep(0.25)
+    assert fetcher.get("ghost") is not None
+    assert stub.upstream.requests == 2
+
+
+def test_not_found_is_logged_without_traceback(stub, caplog):
+    stub.upstream.missing.add("ghost")
+    ProfileFetcher(stub.url).get("ghost")
+    [record] = [r for r in caplog.records if "Instagram" in r.getMessage()]
+    assert record.levelname == "WARNING"
+    assert "404" in record.getMessage()
+    assert "Traceback" not in record.getMessage()
+
+
+def test_breaker_opens_and_recovers_through_a_probe(stub):
+    stub.upstream.error_rate = 1.0
+    breaker = upstream.CircuitBreaker("instagram", failures=2, reset_timeout=0.2)
+    fetcher = ProfileFetcher(stub.url, breaker=breaker)
+    assert fetcher.get("a") is None
+    assert fetcher.get("b") is None
+    assert breaker.is_open()
+    # 열려 있는 동안은 업스트림을 부르지 않는다
+    assert fetcher.get("c") is None
+    assert stub.upstream.requests == 2
+
+    stub.upstream.error_rate = 0.0
+    time.sleep(0.25)
+    assert fetcher.get("d") is not None
+    assert not breaker.is_open()
+    assert stub.upstream.requests == 3
+
+
+def test_async_concurrent_gets_are_coalesced(stub):
+    stub.upstream.latency = 0.2
+
+    async def run():
+        fetcher = AsyncProfileFetcher(stub.url)
+        try:
+            results = await asyncio.gather(*(fetcher.get("amy") for _ in range(8)))
+            again = await fetcher.get("amy")
+        finally:
+            await fetcher.aclose()
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert all(r == results[0] for r in results)
+    assert again == results[0]
+    assert stub.upstream.requests == 1
+
+
+def test_async_fetch_continues_after_caller_gives_up(stub):
+    stub.upstream.latency = 0.2
+
+    async def run():
+        fetcher = AsyncProfileFetcher(stub.url)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(fetcher.get("amy"), 0.05)
+            # 취소된 건 기다리던 쪽뿐이라 가져오기는 끝까지 가서 캐시를 채운다
+            await asyncio.sleep(0.4)
+            return fetcher.cached_usernames(), await fetcher.get("amy")
+        finally:
+            await fetcher.aclose()
+
+    cached, interactions = asyncio.run(run())
+    assert cached == 1
+    assert interactions is not None
+    assert stub.upstream.requests == 1
+
+
+def test_async_breaker_short_circuits(stub):
+    stub.upstream.error_rate = 1.0
+    breaker = upstream.CircuitBreaker("instagram", failures=1, reset_timeout=60)
+
+    async def run():
+        fetcher = AsyncProfileFetcher(stub.url, breaker=breaker)
+        try:
+            return [await fetcher.get(u) for u in ("a", "b", "c")]
+        finally:
+            await fetcher.aclose()
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert breaker.is_open()
+    assert stub.upstream.requests == 1
+
+
+def test_async_failed_fetch_is_negatively_cached(stub):
+    stub.upstream.missing.add("ghost")
+
+    async def run():
+        fetcher = AsyncProfileFetcher(stub.url)
+        try:
+            return [await fetcher.get("ghost") for _ in range(3)]
+        finally:
+            await fetcher.aclose()
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert stub.upstream.requests == 1
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+import cache
+import pipeline
+from prompts import MODEL, MAX_TOKENS, ANALYZE_PROMPT_VERSION
+from schemas import AnalyzeBatch, AnalyzeBatchItem, AnalyzeResult
+
+# 파이프라인 제너레이터를 서버 없이 직접 돌린다. 효과마다 정해진 값을 돌려준다
+
+
+def drive(steps, results: dict) -> tuple:
+    effects, value = [], None
+    while True:
+        try:
+            effect = steps.send(value)
+        except StopIteration as stop:
+            return stop.value, effects
+        effects.append(effect)
+        handler = results.get(type(effect))
+        value = handler(effect) if handler else None
+
+
+def batch_reply(captions: list, keys: bool = True, bypass: bool = False):
+    items = [{"out": {"index": i, "caption": caption},
+              "caption": caption,
+              "group": 0,
+              "key": f"key-{i}" if keys else None} for i, caption in enumerate(captions)]
+    jobs = [(lambda caption: [("single", caption)], lambda captions: [("batch", captions)])]
+    return pipeline.BatchReply(items, jobs, "result", AnalyzeResult, AnalyzeBatch, bypass)
+
+
+def scores(*indexes) -> AnalyzeBatch:
+    return AnalyzeBatch(items=[AnalyzeBatchItem(index=i, probability=i, warning=f"batch {i}",
+                                                recommendation="r") for i in indexes])
+
+
+# 묶음 호출에는 batch_result 를, 단건 다시 묻기에는 캡션을 warning 에 넣은 결과를 준다
+def model(batch_result: AnalyzeBatch):
+    def complete(effect: pipeline.Complete):
+        if effect.schema is AnalyzeBatch:
+            return batch_result
+        _, caption = effect.messages[0]
+        return AnalyzeResult(probability=0, warning=f"single {caption}", recommendation="r")
+    return complete
+
+
+def score(batch: pipeline.BatchReply, batch_result: AnalyzeBatch = None) -> tuple:
+    lines, effects = drive(pipeline.score_chunk(batch, batch.items),
+                           {pipeline.Complete: model(batch_result)})
+    calls = [e for e in effects if isinstance(e, pipeline.Complete)]
+    return [json.loads(line) for line in lines], calls, effects
+
+
+def test_score_chunk_matches_answers_by_index():
+    lines, calls, _ = score(batch_reply(["a", "b", "c"]), scores(3, 1, 2))
+    assert [line["result"]["warning"] for line in lines] == ["batch 1", "batch 2", "batch 3"]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert len(calls) == 1
+    assert calls[0].max_tokens == MAX_TOKENS * 3
+
+
+def test_score_chunk_reasks_duplicate_missing_and_out_of_range_indexes():
+    # 1 은 두 번, 2 와 4 는 빠졌고, 9 는 묶음에 없는 번호다
+    lines, calls, _ = score(batch_reply(["a", "b", "c", "d"]), scores(1, 1, 3, 9))
+    assert [line["result"]["warning"] for line in lines] == [
+        "single a", "single b", "batch 3", "single d"]
+    assert [c.messages for c in calls[1:]] == [[("single", "a")], [("single", "b")],
+                                               [("single", "d")]]
+
+
+def test_score_chunk_with_one_item_skips_the_batch_prompt():
+    lines, calls, _ = score(batch_reply(["only"]))
+    assert [c.schema for c in calls] == [AnalyzeResult]
+    assert calls[0].messages == [("single", "only")]
+    assert lines[0]["result"]["warning"] == "single only"
+
+
+def test_score_chunk_caches_only_keyed_items():
+    _, _, effects = score(batch_reply(["a", "b"]), scores(1, 2))
+    assert [e.key for e in effects if isinstance(e, pipeline.CacheSet)] == ["key-0", "key-1"]
+
+    lines, _, effects = score(batch_reply(["a", "b"], keys=False, bypass=True), scores(1, 2))
+    assert not any(isinstance(e, pipeline.CacheSet) for e in effects)
+    assert {line["cache"] for line in lines} == {"BYPASS"}
+
+
+def test_batch_items_do_not_share_single_request_keys():
+    reply, _ = drive(pipeline.analyze_batch(pipeline.Payload({"captions": ["a"]}, b"img", {}, {})),
+                     {pipeline.Identify: lambda effect: "image-id"})
+    single_key = cache.make_key("analyze", MODEL, ANALYZE_PROMPT_VERSION, "a", "image-id")
+    assert reply.items[0]["key"] != single_key
+
+
+@pytest.mark.parametrize("fields, error", [
+    ({"captions": "a", "target_user_ids": ["amy"]}, "image or captions missing"),
+    ({"captions": [], "target_user_ids": ["amy"]}, "image or captions missing"),
+    ({"captions": ["a", 1], "target_user_ids": ["amy"]}, "captions must be strings"),
+    ({"captions": ["a"]}, "target_user_ids missing"),
+    ({"captions": ["a"], "target_user_ids": "amy"},
+     "target_user_ids must be a list of non-empty strings"),
+    ({"captions": ["a"], "target_user_ids": ["amy", 3]},
+     "target_user_ids must be a list of non-empty strings"),
+    ({"captions": ["a"], "target_user_ids": ["amy", ""]},
+     "target_user_ids must be a list of non-empty strings"),
+])
+def test_parse_batch_rejects_bad_fields(fields, error):
+    assert pipeline.parse_batch(fields, b"img", with_targets=True) == (None, None, error)
+
+
+def test_parse_batch_accepts_one_target_and_drops_duplicates():
+    assert pipeline.parse_batch({"captions": ["a"], "target_user_id": "amy"}, b"img",
+                                with_targets=True) == (["a"], ["amy"], None)
+    assert pipeline.parse_batch({"captions": ["a"], "target_user_ids": ["bob", "amy", "bob"]},
+                                b"img", with_targets=True) == (["a"], ["bob", "amy"], None)
+    assert pipeline.parse_batch({"captions": ["a"]}, None)[2] == "image or captions missing"
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import schemas
+from schemas import AnalyzeResult, FieldStream, MalformedOutput, RiskResult
+
+RESULT = {"probability": 72, "warning": "경고 문장", "recommendation": "추천 문장"}
+
+
+def chunks(text: str, size: int = 3) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_validate_accepts_schema_output():
+    result = schemas.validate(AnalyzeResult, json.dumps(RESULT, ensure_ascii=False))
+    assert result.model_dump() == RESULT
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "not json",
+    json.dumps(dict(RESULT, probability=101)),
+    json.dumps(dict(RESULT, extra="x")),
+    json.dumps({"probability": 50, "warning": "w"}),
+])
+def test_validate_rejects_malformed_output(text):
+    with pytest.raises(MalformedOutput):
+        schemas.validate(AnalyzeResult, text)
+
+
+def test_probability_is_shared_between_schemas():
+    with pytest.raises(MalformedOutput):
+        schemas.validate(RiskResult, json.dumps(
+            {"probability": -1, "sensitive_points": "s", "visibility": "비공개"}))
+
+
+def test_field_stream_emits_fields_once_they_are_complete():
+    stream = FieldStream()
+    events = []
+    for part in chunks(json.dumps(RESULT, ensure_ascii=False)):
+        events += stream.feed(part)
+    # 마지막 필드는 값이 끝났는지 알 수 없으므로 finish 에서 나온다
+    assert events == [("probability", 72), ("warning", "경고 문장")]
+    result = AnalyzeResult.model_validate(RESULT)
+    assert stream.finish(result) == [("recommendation", "추천 문장")]
+    assert stream.finish(result) == []
+
+
+def test_field_stream_waits_on_incomplete_or_non_object_json():
+    assert FieldStream().feed("```") == []
+    assert FieldStream().feed("[1, 2") == []
+    stream = FieldStream()
+    assert stream.feed('{"probabil') == []
+    assert stream.feed('ity": 7') == []
+    assert stream.feed(', "warning": "') == [("probability", 7)]
+
+
+def test_field_stream_reset_resends_validated_fields():
+    stream = FieldStream()
+    for part in chunks('{"probability": 5, "warning": "틀린 값", "recommendation": "x'):
+        stream.feed(part)
+    stream.reset()
+    result = AnalyzeResult.model_validate(RESULT)
+    assert stream.finish(result) == list(RESULT.items())
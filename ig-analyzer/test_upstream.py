@@ -0,0 +1,290 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+import upstream
+from upstream import (AsyncScheduler, CircuitBreaker, CircuitOpen, QueueFull, RateBudget,
+                      RateLimited, Rejected, Scheduler)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream, "time", clock)
+    return clock
+
+
+def api_error(cls, status: int, headers: dict = None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, request=request, headers=headers or {})
+    return cls("upstream error", response=response, body=None)
+
+
+def connection_error():
+    return openai.APIConnectionError(
+        request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+class Completion:
+    usage = None
+
+
+# ——— CircuitBreaker ———
+
+def test_breaker_trips_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failures=3, reset_timeout=10)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()  # 연속이 끊기면 처음부터 다시 센다
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.is_open()
+    breaker.failure()
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("test", failures=1, reset_timeout=10)
+    breaker.failure()
+    clock.sleep(10)
+    assert breaker.allow()
+    # 시험 호출이 끝날 때까지 다른 호출은 막는다
+    assert not breaker.allow()
+    assert breaker.retry_after() == 1.0
+    breaker.success()
+    assert not breaker.is_open()
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("test", failures=1, reset_timeout=10)
+    breaker.failure()
+    clock.sleep(10)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+
+def test_breaker_release_frees_the_probe_slot(clock):
+    breaker = CircuitBreaker("test", failures=1, reset_timeout=10)
+    breaker.failure()
+    clock.sleep(10)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.is_open()
+    assert breaker.allow()
+
+
+# ——— RateBudget ———
+
+def test_budget_without_limits_never_waits(clock):
+    budget = RateBudget()
+    assert all(budget.reserve(10_000) == 0 for _ in range(1000))
+
+
+def test_budget_requests_refill_over_time(clock):
+    budget = RateBudget(rpm=60)
+    assert all(budget.reserve(1) == 0 for _ in range(60))
+    assert budget.reserve(1) == pytest.approx(1.0)
+    clock.sleep(1)
+    assert budget.reserve(1) == 0
+    assert budget.reserve(1) == pytest.approx(1.0)
+
+
+def test_budget_tokens_settle_to_actual_usage(clock):
+    budget = RateBudget(tpm=120)
+    assert budget.reserve(100) == 0
+    # 남은 20 으로는 100 을 못 뗀다: 80 토큰이 차는 데 40초
+    assert budget.reserve(100) == pytest.approx(40)
+    # 실제로는 40 만 썼으면 60 을 돌려받는다
+    budget.settle(100, 40)
+    assert budget.reserve(80) == 0
+
+
+def test_budget_pause_blocks_until_it_expires(clock):
+    budget = RateBudget()
+    budget.pause(5)
+    assert budget.reserve(1) == pytest.approx(5)
+    clock.sleep(5)
+    assert budget.reserve(1) == 0
+
+
+# ——— Scheduler ———
+
+def hold_slot(scheduler: Scheduler):
+    entered, done = threading.Event(), threading.Event()
+
+    def hold():
+        with scheduler.admit(1):
+            entered.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    assert entered.wait(5)
+    return done, thread
+
+
+def test_queue_full_is_rejected_immediately():
+    scheduler = Scheduler("test", concurrency=1, max_queue=0)
+    done, thread = hold_slot(scheduler)
+    try:
+        with pytest.raises(QueueFull) as info:
+            scheduler.check()
+        assert info.value.status == 503
+        assert info.value.retry_after >= 1
+        with pytest.raises(QueueFull):
+            with scheduler.admit(1):
+                pass
+    finally:
+        done.set()
+        thread.join()
+    assert scheduler.active == 0
+
+
+def test_queue_timeout_rejects_waiting_call():
+    scheduler = Scheduler("test", concurrency=1, max_queue=4, queue_timeout=0.1)
+    done, thread = hold_slot(scheduler)
+    try:
+        started = time.monotonic()
+        with pytest.raises(QueueFull):
+            with scheduler.admit(1):
+                pass
+        assert 0.1 <= time.monotonic() - started < 1
+        assert scheduler.waiting == 0
+    finally:
+        done.set()
+        thread.join()
+
+
+def test_budget_wait_beyond_queue_timeout_is_rate_limited():
+    scheduler = Scheduler("test", budget=RateBudget(rpm=1), queue_timeout=0.5)
+    with scheduler.admit(1):
+        pass
+    with pytest.raises(RateLimited) as info:
+        with scheduler.admit(1):
+            pass
+    assert info.value.status == 429
+    assert info.value.retry_after == 60
+    assert scheduler.active == 0
+
+
+def test_call_retries_transient_errors():
+    scheduler = Scheduler("test", retries=2, backoff_base=0.01)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise connection_error()
+        return Completion()
+
+    assert isinstance(scheduler.call(fn, 1), Completion)
+    assert len(calls) == 3
+    assert not scheduler.breaker.is_open()
+
+
+def test_call_converts_exhausted_rate_limit_to_429():
+    scheduler = Scheduler("test", retries=0)
+    error = api_error(openai.RateLimitError, 429, {"retry-after": "7"})
+
+    def fn():
+        raise error
+
+    with pytest.raises(RateLimited) as info:
+        scheduler.call(fn, 1)
+    assert info.value.retry_after == 7
+    assert info.value.__cause__ is error
+    # 레이트 리밋은 브레이커가 아니라 예산을 멈춘다
+    assert not scheduler.breaker.is_open()
+    assert scheduler.budget.reserve(1) > 0
+
+
+def test_call_converts_exhausted_server_errors_and_opens_breaker():
+    scheduler = Scheduler("test", retries=1, backoff_base=0.01, backoff_max=0.01,
+                          breaker=CircuitBreaker("test", failures=2, reset_timeout=60))
+
+    def fn():
+        raise api_error(openai.InternalServerError, 500)
+
+    with pytest.raises(Rejected) as info:
+        scheduler.call(fn, 1)
+    assert type(info.value) is Rejected
+    assert info.value.status == 503
+    assert info.value.retry_after == 1
+    assert scheduler.breaker.is_open()
+    with pytest.raises(CircuitOpen) as info:
+        scheduler.call(fn, 1)
+    assert info.value.retry_after == 60
+
+
+def test_call_passes_through_non_retryable_errors():
+    scheduler = Scheduler("test")
+
+    def fn():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(fn, 1)
+    assert scheduler.active == 0
+    assert scheduler.breaker.allow()
+
+
+# ——— AsyncScheduler ———
+
+def test_async_queue_full_is_rejected():
+    async def run():
+        scheduler = AsyncScheduler("test", concurrency=1, max_queue=0)
+        entered, done = asyncio.Event(), asyncio.Event()
+
+        async def hold():
+            async with scheduler.admit(1):
+                entered.set()
+                await done.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await entered.wait()
+        try:
+            with pytest.raises(QueueFull):
+                async with scheduler.admit(1):
+                    pass
+        finally:
+            done.set()
+            await holder
+        return scheduler.active
+
+    assert asyncio.run(run()) == 0
+
+
+def test_async_call_converts_exhausted_errors():
+    scheduler = AsyncScheduler("test", retries=1, backoff_base=0.01, backoff_max=0.01)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        raise connection_error()
+
+    with pytest.raises(Rejected) as info:
+        asyncio.run(scheduler.call(fn, 1))
+    assert info.value.status == 503
+    assert isinstance(info.value.__cause__, openai.APIConnectionError)
+    assert len(calls) == 2
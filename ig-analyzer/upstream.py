@@ -0,0 +1,452 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+import metrics
+
+# ——— 업스트림 호출 입장 관리 ———
+# OpenAI 호출 앞에서 동시 호출 수를 묶고(짧은 대기열), 분당 요청/토큰 예산을 지키고,
+# 실패하면 지터를 넣은 지수 백오프로 다시 시도한다. 대기열이 차거나 예산을 기다릴 수 없으면
+# 워커를 붙잡아 두지 않고 바로 429/503 + Retry-After 로 돌려보낸다.
+# 서킷 브레이커는 업스트림(OpenAI, Instagram)마다 따로 두고, 열려 있는 동안에는 호출하지 않는다.
+# 예산은 프로세스마다 따로 잡히므로 계정 한도를 워커 수(WEB_CONCURRENCY)로 나눠 쓴다
+
+# 모델별 기본 한도 (분당 요청 수, 분당 토큰 수). OPENAI_RPM / OPENAI_TPM 으로 바꿀 수 있다
+MODEL_LIMITS = {
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+}
+
+# 다시 시도해 볼 만한 오류: 레이트 리밋, 타임아웃/연결 실패, 5xx
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class Rejected(Exception):
+    status = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class QueueFull(Rejected):
+    pass
+
+
+class RateLimited(Rejected):
+    status = 429
+
+
+class CircuitOpen(Rejected):
+    pass
+
+
+# 한국어 위주라 글자 2개에 토큰 1개 정도로 넉넉하게 잡고, 응답이 오면 실제 사용량으로 맞춘다
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    return sum(len(str(m["content"])) for m in messages) // 2 + max_tokens
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after_header(e) -> float:
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # 열린 지 reset_timeout 이 지나면 시험 호출 하나만 통과시킨다 (half-open)
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info("%s 서킷 닫힘", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failures):
+                if not self._probing:
+                    logging.warning("%s 서킷 열림 (연속 실패 %d회)", self.name, self._failures)
+                    metrics.UPSTREAM_EVENTS.inc(self.name, "tripped")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    # 성공도 실패도 아닌 결과(호출 쪽 오류 등) — 시험 호출 자리만 돌려놓는다
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    # 지금 막혀 있다면 몇 초 뒤에 다시 와야 하는지, 아니면 0
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            if self._probing:
+                return 1.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def gauges(self) -> list:
+        return metrics.gauge(f"safepost_{self.name}_breaker_open", "서킷 브레이커 열림 여부",
+                             int(self.is_open()))
+
+
+# 분당 요청/토큰 한도를 토큰 버킷 두 개로 지킨다. 한도가 0 이면 제한 없음
+class RateBudget:
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = rpm
+        self._tokens = tpm
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    # 지금 쓸 수 있으면 예산을 떼고 0, 아니면 기다려야 하는 시간(초)
+    def reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            waits = [self._paused_until - now]
+            if self.rpm and self._requests < 1:
+                waits.append((1 - self._requests) * 60 / self.rpm)
+            if self.tpm:
+                tokens = min(tokens, self.tpm)
+                if self._tokens < tokens:
+                    waits.append((tokens - self._tokens) * 60 / self.tpm)
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            self._requests -= 1
+            self._tokens -= tokens
+            return 0.0
+
+    # 실제 사용량이 나오면 추정치와의 차이만큼 돌려주거나 더 뗀다
+    def settle(self, reserved: int, used: int):
+        if not self.tpm:
+            return
+        with self._lock:
+            self._tokens = min(self.tpm, self._tokens + min(reserved, self.tpm) - used)
+
+    # 업스트림이 429 를 주면 이 프로세스의 호출을 잠깐 모두 멈춘다
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class Ticket:
+    def __init__(self, budget: RateBudget, tokens: int):
+        self.budget = budget
+        self.tokens = tokens
+
+    def settle(self, usage):
+        if usage is not None:
+            self.budget.settle(self.tokens, usage.total_tokens)
+
+
+# 동기/비동기 스케줄러가 같이 쓰는 부분. 기다리는 방법만 다르다
+class _Scheduler:
+    def __init__(self, name: str, budget: RateBudget = None, breaker: CircuitBreaker = None,
+                 concurrency: int = 8, max_queue: int = 32, queue_timeout: float = 5.0,
+                 retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.name = name
+        self.budget = budget or RateBudget()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.active = 0
+        self.waiting = 0
+        # 최근 호출 시간의 지수이동평균 — 대기열이 찼을 때 Retry-After 를 어림하는 데 쓴다
+        self._latency = 1.0
+
+    def _reject(self, error: Rejected, event: str) -> Rejected:
+        metrics.UPSTREAM_EVENTS.inc(self.name, event)
+        return error
+
+    def _queue_full(self) -> Rejected:
+        wait = self._latency * (self.waiting + 1) / self.concurrency
+        return self._reject(QueueFull(f"{self.name} queue full", wait), "queue_full")
+
+    def _circuit_open(self) -> Rejected:
+        wait = self.breaker.retry_after() or self.breaker.reset_timeout
+        return self._reject(CircuitOpen(f"{self.name} unavailable", wait), "circuit_open")
+
+    def _full(self) -> bool:
+        return self.active >= self.concurrency and self.waiting >= self.max_queue
+
+    # 기다려 봐야 소용없는 경우를 응답을 시작하기 전에 미리 거른다 (스트리밍용)
+    def check(self):
+        if self.breaker.retry_after():
+            raise self._circuit_open()
+        if self._full():
+            raise self._queue_full()
+
+    def _limit(self, deadline: float = None) -> float:
+        limit = time.monotonic() + self.queue_timeout
+        return min(limit, deadline) if deadline else limit
+
+    def _budget_wait(self, tokens: int, limit: float) -> float:
+        wait = self.budget.reserve(tokens)
+        if wait and time.monotonic() + wait > limit:
+            raise self._reject(RateLimited(f"{self.name} rate limit", wait), "rate_limited")
+        return wait
+
+    def _finish(self, started: float, error: BaseException = None):
+        self._latency += (time.monotonic() - started - self._latency) * 0.2
+        if error is None:
+            self.breaker.success()
+        elif isinstance(error, openai.RateLimitError):
+            # 업스트림이 살아 있지만 한도에 걸린 것 — 브레이커 대신 예산을 잠깐 멈춘다
+            self.budget.pause(_retry_after_header(error) or self.backoff_base)
+            self.breaker.release()
+        elif isinstance(error, RETRYABLE):
+            metrics.UPSTREAM_EVENTS.inc(self.name, "failure")
+            self.breaker.failure()
+        elif isinstance(error, openai.APIStatusError):
+            self.breaker.success()
+        else:
+            self.breaker.release()
+
+    def _retry_delay(self, attempt: int, error: BaseException, deadline: float = None):
+        if attempt >= self.retries:
+            return None
+        delay = max(backoff(attempt, self.backoff_base, self.backoff_max),
+                    _retry_after_header(error))
+        if deadline and time.monotonic() + delay > deadline:
+            return None
+        metrics.UPSTREAM_EVENTS.inc(self.name, "retry")
+        logging.warning("%s 호출 실패(%s), %.2f초 뒤 다시 시도",
+                        self.name, type(error).__name__, delay)
+        return delay
+
+    # 재시도를 다 쓴 업스트림 오류는 500 대신 Retry-After 가 붙은 거절로 바꾼다.
+    # 업스트림이 알려준 retry-after 가 없으면 다음 백오프의 상한을 쓴다
+    def _give_up(self, attempt: int, error: BaseException) -> Rejected:
+        wait = (_retry_after_header(error)
+                or min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(error, openai.RateLimitError):
+            return self._reject(RateLimited(f"{self.name} rate limit", wait), "exhausted")
+        return self._reject(Rejected(f"{self.name} unavailable", wait), "exhausted")
+
+    def gauges(self) -> list:
+        return (metrics.gauge(f"safepost_{self.name}_inflight", "진행 중인 업스트림 호출 수",
+                              self.active)
+                + metrics.gauge(f"safepost_{self.name}_queued", "입장 대기 중인 호출 수",
+                                self.waiting)
+                + self.breaker.gauges())
+
+
+class Scheduler(_Scheduler):
+    def __init__(self, name: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self._cond = threading.Condition()
+
+    def _enter(self, tokens: int, deadline: float = None):
+        self.check()
+        limit = self._limit(deadline)
+        with self._cond:
+            if self._full():
+                raise self._queue_full()
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.concurrency,
+                                               max(0.0, limit - time.monotonic()))
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                raise self._queue_full()
+            self.active += 1
+        try:
+            while True:
+                wait = self._budget_wait(tokens, limit)
+                if not wait:
+                    break
+                time.sleep(wait)
+            if not self.breaker.allow():
+                raise self._circuit_open()
+        except BaseException:
+            self._leave()
+            raise
+
+    def _leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    # with scheduler.admit(tokens) as ticket: — 블록 안에서 업스트림을 한 번 부른다
+    @contextmanager
+    def admit(self, tokens: int, deadline: float = None):
+        with metrics.stage("queue"):
+            self._enter(tokens, deadline)
+        started = time.monotonic()
+        try:
+            yield Ticket(self.budget, tokens)
+        except BaseException as e:
+            self._finish(started, e)
+            raise
+        else:
+            self._finish(started)
+        finally:
+            self._leave()
+
+    # fn 은 OpenAI 응답을 돌려주는 함수. 재시도할 때마다 입장 절차를 다시 밟는다
+    def call(self, fn, tokens: int, deadline: float = None):
+        for attempt in range(self.retries + 1):
+            try:
+                with self.admit(tokens, deadline) as ticket:
+                    result = fn()
+                    ticket.settle(getattr(result, "usage", None))
+                    return result
+            except RETRYABLE as e:
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise self._give_up(attempt, e) from e
+                time.sleep(delay)
+
+
+# aio.py 용 — 이벤트 루프 하나 안에서 기다리므로 asyncio.Condition 을 쓴다
+class AsyncScheduler(_Scheduler):
+    def __init__(self, name: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self._cond = asyncio.Condition()
+
+    async def _enter(self, tokens: int, deadline: float = None):
+        self.check()
+        limit = self._limit(deadline)
+        async with self._cond:
+            if self._full():
+                raise self._queue_full()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.active < self.concurrency),
+                    max(0.0, limit - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise self._queue_full() from None
+            finally:
+                self.waiting -= 1
+            self.active += 1
+        try:
+            while True:
+                wait = self._budget_wait(tokens, limit)
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+            if not self.breaker.allow():
+                raise self._circuit_open()
+        except BaseException:
+            await self._leave()
+            raise
+
+    async def _leave(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def admit(self, tokens: int, deadline: float = None):
+        with metrics.stage("queue"):
+            await self._enter(tokens, deadline)
+        started = time.monotonic()
+        try:
+            yield Ticket(self.budget, tokens)
+        except BaseException as e:
+            self._finish(started, e)
+            raise
+        else:
+            self._finish(started)
+        finally:
+            await self._leave()
+
+    async def call(self, fn, tokens: int, deadline: float = None):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.admit(tokens, deadline) as ticket:
+                    result = await fn()
+                    ticket.settle(getattr(result, "usage", None))
+                    return result
+            except RETRYABLE as e:
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise self._give_up(attempt, e) from e
+                await asyncio.sleep(delay)
+
+
+def breaker_from_env(name: str) -> CircuitBreaker:
+    prefix = name.upper()
+    return CircuitBreaker(
+        name,
+        failures=int(os.getenv(f"{prefix}_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", 30)),
+    )
+
+
+def _env_kwargs(model: str) -> dict:
+    rpm, tpm = MODEL_LIMITS.get(model, (0, 0))
+    processes = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+    return dict(
+        budget=RateBudget(float(os.getenv("OPENAI_RPM", rpm)) / processes,
+                          float(os.getenv("OPENAI_TPM", tpm)) / processes),
+        breaker=breaker_from_env("openai"),
+        concurrency=int(os.getenv("OPENAI_CONCURRENCY", 8)),
+        max_queue=int(os.getenv("OPENAI_QUEUE", 32)),
+        queue_timeout=float(os.getenv("OPENAI_QUEUE_TIMEOUT", 5)),
+        retries=int(os.getenv("OPENAI_RETRIES", 2)),
+        backoff_base=float(os.getenv("OPENAI_BACKOFF_BASE", 0.5)),
+        backoff_max=float(os.getenv("OPENAI_BACKOFF_MAX", 8)),
+    )
+
+
+def from_env(model: str) -> Scheduler:
+    return Scheduler("openai", **_env_kwargs(model))
+
+
+def async_from_env(model: str) -> AsyncScheduler:
+    return AsyncScheduler("openai", **_env_kwargs(model))
@@ -3,7 +3,7 @@ import './index.css';
 
 function App() {
   const [image, setImage] = useState(null);
-  const [result, setResult] = useState('');
+  const [result, setResult] = useState(null);
   const [loading, setLoading] = useState(false);
 
   const handleImageChange = (e) => {
@@ -34,18 +34,6 @@ function App() {
     }
   };
 
-  const extractAnalysis = (text) => {
-    const scoreMatch = text.match(/싫어하지 않을 확률:\s*(\d+)/);
-    const warningMatch = text.match(/경고:\s*(.*)/);
-    const recommendationMatch = text.match(/추천:\s*(.*)/);
-
-    const score = scoreMatch ? parseInt(scoreMatch[1], 10) : null;
-    const warning = warningMatch ? warningMatch[1].trim() : null;
-    const recommendation = recommendationMatch ? recommendationMatch[1].trim() : null;
-
-    return { score, warning, recommendation };
-  };
-
   return (
     <div className="min-h-screen bg-gradient-to-br from-indigo-200 via-purple-300 to-blue-300 flex items-center justify-center px-4 py-12 text-gray-800">
       <div className="bg-white rounded-3xl shadow-2xl p-10 max-w-md w-full">
@@ -80,8 +68,8 @@ function App() {
             <h3 className="text-xl font-semibold mb-3">📊 분석 결과</h3>
 
             {(() => {
-              const { score, warning, recommendation } = extractAnalysis(result);
-              if (score !== null && warning && recommendation) {
+              const { probability: score, warning, recommendation } = result;
+              if (Number.isInteger(score) && warning && recommendation) {
                 return (
                   <pre className="whitespace-pre-wrap text-sm font-medium text-gray-700">
 📊 이 게시물은 {score}% 확률로 안전합니다.